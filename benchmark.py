@@ -0,0 +1,240 @@
+"""
+End-to-end scene benchmarks for the pycaster.
+
+Flies the camera along fixed, reproducible paths through a set of maps and reports frame-time
+percentiles broken down by stage. Wall count and resolution scale are swept to produce scaling
+curves, and the results are written as JSON so runs can be compared across commits.
+
+Usage:
+    python benchmark.py [--output bench.json] [--frames 120] [--quick]
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import time
+
+import numpy as np
+
+import generator
+import headless
+import pycaster
+
+WIDTH = 800
+HEIGHT = 600
+WALL_HEIGHT = 1000
+
+# Maps are looked up next to this file so the benchmark works from any working directory
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Stages reported for every scene, in pipeline order
+STAGES = ["update_cone", "broad_phase", "check_collisions", "generate_frame", "draw"]
+
+
+def load_walls(filename):
+    """
+    Loads every wall in a map file
+    :param filename: map in the WorldState text format
+    :return: list of walls
+    """
+    world_objects = pycaster.WorldState()
+    world_objects.load_state(filename)
+    return [w for k in world_objects.get_all_walls() for w in world_objects.get_all_walls()[k]]
+
+
+def get_bounds(walls):
+    """
+    :return: ((min x, min y), (max x, max y)) of a list of walls
+    """
+    xs = [p[0] for w in walls for p in (w.get_p1(), w.get_p2())]
+    ys = [p[1] for w in walls for p in (w.get_p1(), w.get_p2())]
+    return (min(xs), min(ys)), (max(xs), max(ys))
+
+
+def orbit_path(lo, hi, frames):
+    """
+    Circles the middle of the map looking along the direction of travel, then spins in place
+    :param lo: (min x, min y) of the map
+    :param hi: (max x, max y) of the map
+    :param frames: number of poses
+    :return: list of (position, rotation) poses
+    """
+    center = ((lo[0] + hi[0]) / 2, (lo[1] + hi[1]) / 2)
+    radius = min(hi[0] - lo[0], hi[1] - lo[1]) / 3
+    orbit = frames // 2
+    path = []
+    for i in range(orbit):
+        a = 2 * math.pi * i / orbit
+        path.append(((center[0] + radius * math.cos(a), center[1] + radius * math.sin(a)), (a + math.pi / 2) % (2 * math.pi)))
+    for i in range(frames - orbit):
+        path.append((center, 2 * math.pi * i / (frames - orbit)))
+    return path
+
+
+def sweep_path(lo, hi, frames):
+    """
+    Walks diagonally across the map while slowly turning
+    :param lo: (min x, min y) of the map
+    :param hi: (max x, max y) of the map
+    :param frames: number of poses
+    :return: list of (position, rotation) poses
+    """
+    path = []
+    for i in range(frames):
+        t = i / max(frames - 1, 1)
+        position = (lo[0] + (hi[0] - lo[0]) * t, lo[1] + (hi[1] - lo[1]) * t)
+        path.append((position, (math.pi / 4 + math.sin(t * 4 * math.pi)) % (2 * math.pi)))
+    return path
+
+
+def summarize(samples):
+    """
+    :param samples: list of times in ms
+    :return: percentiles, max and mean of the samples
+    """
+    samples = np.asarray(samples, dtype=np.float64)
+    return {
+        "p50": round(float(np.percentile(samples, 50)), 4),
+        "p95": round(float(np.percentile(samples, 95)), 4),
+        "p99": round(float(np.percentile(samples, 99)), 4),
+        "max": round(float(samples.max()), 4),
+        "mean": round(float(samples.mean()), 4)
+    }
+
+
+def run_scene(caster, path, warmup=5):
+    """
+    Renders every pose along a path and records the time spent in each stage
+    :param caster: HeadlessCaster with the scene loaded
+    :param path: list of (position, rotation) poses
+    :param warmup: poses rendered before recording, so lazily built indexes aren't counted
+    :return: dict of stage -> list of times in ms, plus the total frame time
+    """
+    engine = caster.get_engine()
+    samples = {stage: [] for stage in STAGES + ["frame"]}
+    # Per-tile cast times, only filled by the thread cast mode
+    tile_samples = []
+    for i, (position, rotation) in enumerate(path[:warmup] + path):
+        start = time.perf_counter()
+        frame = caster.step(position, rotation)
+        draw_start = time.perf_counter()
+        caster.get_renderer().fill(frame)
+        end = time.perf_counter()
+        if i < warmup:
+            continue
+        stage_times = engine.get_debug_stats()["time"]
+        for stage in STAGES[:-1]:
+            samples[stage].append(stage_times[stage])
+        samples["draw"].append((end - draw_start) * 1000)
+        samples["frame"].append((end - start) * 1000)
+        if engine.cast_mode == "thread":
+            tile_samples += [ms for _, _, ms in engine.thread_caster.get_tile_times()]
+    if tile_samples:
+        samples["cast_tile"] = tile_samples
+    return samples
+
+
+def benchmark_scene(name, walls, resolution_scale, frames, cast_mode=None, tile_size=None, circles=()):
+    """
+    Benchmarks one map at one resolution scale along every camera path
+    :param circles: circles added to the map alongside the walls
+    :return: JSON-ready result dict
+    """
+    caster = headless.HeadlessCaster(WIDTH, HEIGHT, WALL_HEIGHT)
+    engine = caster.get_engine()
+    if cast_mode is not None:
+        engine.cast_mode = cast_mode
+    if tile_size is not None:
+        engine.thread_caster.tile_size = tile_size
+    engine.camera.set_resolution_scale(resolution_scale)
+    caster.get_world_state().add_walls("default", walls)
+    if circles:
+        caster.get_world_state().add_circles("pillars", list(circles))
+
+    lo, hi = get_bounds(walls)
+    result = {
+        "scene": name,
+        "walls": len(walls),
+        "circles": len(circles),
+        "resolution_scale": resolution_scale,
+        "columns": engine.camera.get_ray_count(),
+        "cast_mode": engine.cast_mode,
+        "tile_size": engine.thread_caster.tile_size,
+        "paths": {}
+    }
+    for path_name, path in (("orbit", orbit_path(lo, hi, frames)), ("sweep", sweep_path(lo, hi, frames))):
+        samples = run_scene(caster, path)
+        result["paths"][path_name] = {
+            "frames": len(path),
+            "stages": {stage: summarize(samples[stage]) for stage in samples}
+        }
+    return result
+
+
+def get_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=ROOT).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end pycaster scene benchmarks")
+    parser.add_argument("--output", default="bench_output.json", help="where to write the JSON results")
+    parser.add_argument("--frames", type=int, default=120, help="poses along each camera path")
+    parser.add_argument("--resolution-scales", default="50,10,2", help="comma separated resolutionScale sweep")
+    parser.add_argument("--wall-counts", default="1000,10000,50000", help="comma separated sizes of generated maps")
+    parser.add_argument("--layouts", default="maze,rooms,clutter", help="comma separated generated map layouts")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the generated maps")
+    parser.add_argument("--cast-mode", default=None, help="override castMode from settings.ini")
+    parser.add_argument("--tile-size", type=int, default=None, help="override tileSize from settings.ini")
+    parser.add_argument("--circles", type=int, default=0, help="circular pillars scattered over each generated map")
+    parser.add_argument("--quick", action="store_true", help="small sweep for smoke testing")
+    args = parser.parse_args()
+
+    resolution_scales = [int(v) for v in args.resolution_scales.split(",")]
+    wall_counts = [int(v) for v in args.wall_counts.split(",")]
+    layouts = args.layouts.split(",")
+    frames = args.frames
+    if args.quick:
+        resolution_scales = resolution_scales[:1]
+        wall_counts = wall_counts[:1]
+        frames = min(frames, 20)
+
+    scenes = [("map.txt", load_walls(os.path.join(ROOT, "map.txt")), []),
+              ("examples/maze.txt", load_walls(os.path.join(ROOT, "examples", "maze.txt")), [])]
+    for layout in layouts:
+        for n in wall_counts:
+            walls = generator.generate(layout, n, args.seed)
+            scenes.append((f"{layout}_{n}", walls, generator.generate_pillars(args.circles, *get_bounds(walls), args.seed)))
+
+    results = {
+        "meta": {
+            "commit": get_commit(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "width": WIDTH,
+            "height": HEIGHT
+        },
+        "scenes": []
+    }
+    for name, walls, circles in scenes:
+        for resolution_scale in resolution_scales:
+            result = benchmark_scene(name, walls, resolution_scale, frames, args.cast_mode, args.tile_size, circles)
+            results["scenes"].append(result)
+            frame = result["paths"]["orbit"]["stages"]["frame"]
+            print(f"{name:24} walls={result['walls']:<7} circles={result['circles']:<6} columns={result['columns']:<6} "
+                  f"p50={frame['p50']:.2f}ms p95={frame['p95']:.2f}ms p99={frame['p99']:.2f}ms")
+
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,10 @@
 import math
 
+import numpy as np
 import pygame
 
+import mapio
+
 FRAME_RATE = 60
 SCREEN_WIDTH = 1200
 SCREEN_HEIGHT = 800
@@ -193,10 +196,11 @@ class Map:
         y = (pos[1] * (self.map_rect.h / MAP_COL_COUNT)) + self.map_rect_offset + self.rect.top
         return x, y
 
-    def save_state(self):
-        filename = "map.txt"
-        with open(filename, 'w') as file:
-            data = ""
+    def save_state(self, filename="map.txt"):
+        if filename.endswith(mapio.EXTENSION):
+            self.save_binary_state(filename)
+            return
+        with mapio.TextMapWriter(filename) as writer:
             tile_set = "default"
             pycaster_scale = 10
             for line in self.lines:
@@ -204,25 +208,34 @@ class Map:
                 p2 = self.translate_to_normal(line.p2) * pycaster_scale
                 p1 = p1[0] * pycaster_scale, p1[1] * pycaster_scale
                 p2 = p2[0] * pycaster_scale, p2[1] * pycaster_scale
-                data += f"{tile_set}: {p1}; {p2}; {line.color}\n"
-            # Remove trailing newline
-            data = data[0:len(data) - 1]
-            file.write(data)
-            file.close()
+                writer.write_wall(tile_set, p1, p2, line.color)
+
+    def save_binary_state(self, filename):
+        tile_set = "default"
+        pycaster_scale = 10
+        walls = np.zeros(len(self.lines), dtype=mapio.WALL_DTYPE)
+        for i, line in enumerate(self.lines):
+            p1 = self.translate_to_normal(line.p1)
+            p2 = self.translate_to_normal(line.p2)
+            walls[i] = ((p1[0] * pycaster_scale, p1[1] * pycaster_scale), (p2[0] * pycaster_scale, p2[1] * pycaster_scale),
+                        0, line.color, 0)
+        mapio.save_map(filename, [tile_set], walls)
 
     # TODO: Not currently scaling coordinates properly
-    def load_state(self):
-        filename = "map.txt"
-        with open(filename, 'r') as file:
-            self.lines.clear()
-            pycaster_scale = 10
-            for line in file:
-                line_split = line.split(':')
-                vals = line_split[1].split('; ')
-                p1 = self.translate_to_map(eval(vals[0]))
-                p2 = self.translate_to_map(eval(vals[1]))
-                color = eval(vals[2])
-                self.lines.append(Line(p1, p2, color))
+    def load_state(self, filename="map.txt"):
+        if mapio.is_binary_map(filename):
+            self.load_binary_state(filename)
+            return
+        self.lines.clear()
+        for kind, key, p1, p2, color in mapio.iter_text_map(filename):
+            if kind == "wall":
+                self.lines.append(Line(self.translate_to_map(p1), self.translate_to_map(p2), color))
+
+    def load_binary_state(self, filename):
+        walls = mapio.load_map(filename).get_walls()
+        self.lines.clear()
+        for p1, p2, color in zip(walls["p1"].tolist(), walls["p2"].tolist(), walls["color"].tolist()):
+            self.lines.append(Line(self.translate_to_map(p1), self.translate_to_map(p2), tuple(color)))
 
     def reset_state(self):
         self.lines.clear()
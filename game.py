@@ -2,14 +2,15 @@ import configparser
 import pygame
 
 import geometry
+import mapio
 import menus
 import pycaster
+import renderer
 from instances import GameState
 
 # Clean up game.py. We could have all menus and an 'engine controller' inherit from a class that has a
 # process_inputs(), update(), and process_outputs() method. This way, we could set the state of the game,
 # and just call that state's three methods.
-# IDEA: You could use Mazetric from 376 to generate a maze
 
 # Collection of pre-defined colors
 colors = {
@@ -54,14 +55,7 @@ def gen_walls():
     Loads the walls from map.txt
     :return:
     """
-    with open("map.txt", 'r') as file:
-        walls = []
-        for line in file:
-            line_split = line.split(':')
-            key = line_split[0]
-            vals = line_split[1].split('; ')
-            walls.append(geometry.Wall(eval(vals[0]), eval(vals[1]), eval(vals[2])))
-        return walls
+    return [geometry.Wall(a, b, color) for kind, key, a, b, color in mapio.iter_text_map("map.txt") if kind == "wall"]
 
 
 def consolidate_walls(key):
@@ -106,7 +100,7 @@ def cull_redundant_walls(key):
             if w1.get_p1() == w2.get_p2() and w1.get_p2() == w2.get_p1():
                 redundant_walls.append((key, w1))
     for r_wall in redundant_walls:
-        walls[r_wall[0]].remove(r_wall[1])
+        engine.get_world_state().remove_wall(r_wall[0], r_wall[1])
 
 
 def gen_circles():
@@ -126,13 +120,8 @@ def draw_frame():
     """
     screen = pygame.display.get_surface()
     frame = engine.process_outputs()
-    screen.fill(colors["BLACK"])
-    pygame.draw.rect(screen, colors["SKY"], ((0, 0), (width, height / 2)))
-    pygame.draw.rect(screen, colors["GROUND"], ((0, height / 2), (width, height)))
-    segment_width = frame.get_segment_width()
-    segments = frame.get_segments()
-    for segment in segments:
-        pygame.draw.line(screen, segment.get_color(), segment.get_p1(), segment.get_p2(), segment_width)
+    with engine.get_profiler().span("draw"):
+        frame_renderer.draw(screen, frame)
 
 
 def get_debug_dict():
@@ -140,7 +129,10 @@ def get_debug_dict():
         'fps': clock.get_fps(),
         'cur_pos': engine.get_cur_position(),
         'is_detailed_debug': is_detailed_debug,
-        'debug_rays': engine.debug(),
+        'is_frame_graph': is_frame_graph,
+        'frame_stats': engine.get_frame_stats(),
+        # Only the detailed debug overlay draws the rays
+        'debug_rays': engine.debug() if is_detailed_debug else None,
         'debug_walls': engine.get_world_state().get_all_walls(),
         'engine_debug': engine.get_debug_stats()
     }
@@ -170,6 +162,12 @@ def process_inputs():
                     save_state("map.txt")
                 if event.key == pygame.K_p:
                     engine.get_world_state().load_state("map.txt")
+                # Dump recent timing spans for a trace viewer
+                if event.key == pygame.K_t:
+                    engine.get_profiler().export_chrome_trace("trace.json")
+                # Dump frame and stage time percentiles
+                if event.key == pygame.K_c:
+                    engine.get_frame_stats().export_csv("frame_stats.csv")
             # Check for exit condition
             if event.type == pygame.QUIT:
                 running = False
@@ -225,7 +223,8 @@ def process_output():
     """
     if current_state is GameState.GAME:
         draw_frame()
-        game_hud.process_outputs()
+        with engine.get_profiler().span("hud"):
+            game_hud.process_outputs()
         # if is_debug:
         #     draw_debug()
 
@@ -250,9 +249,12 @@ def run():
     while running:
         # Tick the clock
         dt = clock.tick(120) / 1000
-        running = process_inputs()
-        update(dt)
-        process_output()
+        # Time between frames including the wait in tick, unlike the frame span
+        engine.get_frame_stats().add("interval", dt * 1000)
+        with engine.get_profiler().span("frame"):
+            running = process_inputs()
+            update(dt)
+            process_output()
     pygame.quit()
 
 
@@ -265,8 +267,10 @@ width = de_config.getint('width')
 height = de_config.getint('height')
 is_debug = de_config.getboolean('isDebug')
 is_detailed_debug = de_config.getboolean('isDetailedDebug')
+is_frame_graph = de_config.getboolean('isFrameGraph', fallback=False)
 is_full_screen = de_config.getboolean('isFullScreen')
 wall_height = de_config.getint('wallHeight')
+renderer_name = de_config.get('renderer', 'line')
 
 pygame.init()
 
@@ -286,6 +290,7 @@ pygame.display.set_caption("RayCaster")
 pygame.display.set_mode((width, height), is_full_screen)
 
 engine = pycaster.Engine(width, height, wall_height, (7, 7))
+frame_renderer = renderer.get_renderer(renderer_name, width, height, colors["SKY"], colors["GROUND"])
 world_objects = pycaster.WorldState()
 world_objects.add_walls("default", gen_walls())
 world_objects.add_circles("default", gen_circles())
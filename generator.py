@@ -0,0 +1,226 @@
+"""
+Procedural map generator for stress testing the pycaster.
+
+Generates mazes, rooms-and-corridors layouts and random clutter at a requested wall count and
+density, optionally scattered with circular pillars, and saves them in the WorldState file format.
+Every layout takes a seed so performance runs are repeatable.
+
+Usage:
+    python generator.py <maze|rooms|clutter> <wall count> <output file> [--seed 0] [--density 1.0] [--circles 0]
+"""
+import argparse
+import math
+import random
+
+import geometry
+import pycaster
+
+WALL_COLOR = (255, 255, 255)
+ROOM_COLOR = (150, 150, 150)
+PILLAR_COLOR = (200, 180, 120)
+
+
+def get_spacing(density):
+    """
+    Converts a density into a grid spacing
+    :param density: average number of walls per 100x100 world units
+    :return: width of a grid cell holding roughly one wall
+    """
+    return 100 / math.sqrt(density)
+
+
+def generate_maze(wall_count, seed=0, density=1.0):
+    """
+    Generates a perfect maze with a recursive backtracker
+    :param wall_count: number of walls to generate
+    :param seed: random seed
+    :param density: average number of walls per 100x100 world units
+    :return: list of walls
+    """
+    rng = random.Random(seed)
+    spacing = get_spacing(density)
+    # A perfect maze on an n x n grid keeps about n^2 + 2n walls
+    n = max(2, math.ceil(math.sqrt(wall_count)))
+
+    # Open passages between cells, stored as (cell, neighbour) pairs in both directions
+    passages = set()
+    visited = {(0, 0)}
+    stack = [(0, 0)]
+    while stack:
+        x, y = stack[-1]
+        neighbours = [(x + dx, y + dy) for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1))
+                      if 0 <= x + dx < n and 0 <= y + dy < n and (x + dx, y + dy) not in visited]
+        if not neighbours:
+            stack.pop()
+            continue
+        cell = rng.choice(neighbours)
+        passages.add(((x, y), cell))
+        passages.add((cell, (x, y)))
+        visited.add(cell)
+        stack.append(cell)
+
+    walls = []
+    for x in range(n):
+        for y in range(n):
+            # Each cell owns its right and bottom edge, the outer left and top edges are added below
+            if ((x, y), (x + 1, y)) not in passages:
+                walls.append(geometry.Wall(((x + 1) * spacing, y * spacing), ((x + 1) * spacing, (y + 1) * spacing), WALL_COLOR))
+            if ((x, y), (x, y + 1)) not in passages:
+                walls.append(geometry.Wall((x * spacing, (y + 1) * spacing), ((x + 1) * spacing, (y + 1) * spacing), WALL_COLOR))
+        walls.append(geometry.Wall((0, x * spacing), (0, (x + 1) * spacing), WALL_COLOR))
+        walls.append(geometry.Wall((x * spacing, 0), ((x + 1) * spacing, 0), WALL_COLOR))
+    return trim(walls, wall_count, rng)
+
+
+def generate_rooms(wall_count, seed=0, density=1.0):
+    """
+    Generates a grid of rooms with doorways, joined to their neighbours by corridors
+    :param wall_count: number of walls to generate
+    :param seed: random seed
+    :param density: average number of walls per 100x100 world units
+    :return: list of walls
+    """
+    rng = random.Random(seed)
+    # Each room has 8 walls (4 sides split by a doorway) plus 2 corridor walls to each of 2 neighbours,
+    # except along the far edges of the grid
+    n = max(1, math.ceil(math.sqrt(wall_count / 12)))
+    while 8 * n * n + 4 * n * (n - 1) < wall_count:
+        n += 1
+    # Each slot holds about 12 walls
+    slot = get_spacing(density) * math.sqrt(12)
+    door = slot * 0.1
+
+    walls = []
+    rooms = []
+    for i in range(n):
+        for j in range(n):
+            # Rooms are randomly sized and placed inside their slot, leaving room for corridors
+            w = slot * rng.uniform(0.4, 0.7)
+            h = slot * rng.uniform(0.4, 0.7)
+            x = i * slot + rng.uniform(0.1, 0.9 - w / slot) * slot
+            y = j * slot + rng.uniform(0.1, 0.9 - h / slot) * slot
+            rooms.append((x, y, w, h))
+            corners = ((x, y), (x + w, y), (x + w, y + h), (x, y + h))
+            for k in range(4):
+                walls += split_doorway(corners[k], corners[(k + 1) % 4], door)
+
+    for i in range(n):
+        for j in range(n):
+            x, y, w, h = rooms[i * n + j]
+            # Corridor from the right doorway to the left doorway of the next room along x
+            if i + 1 < n:
+                nx, ny, nw, nh = rooms[(i + 1) * n + j]
+                a = (x + w, y + h / 2)
+                b = (nx, ny + nh / 2)
+                walls.append(geometry.Wall((a[0], a[1] - door / 2), (b[0], b[1] - door / 2), WALL_COLOR))
+                walls.append(geometry.Wall((a[0], a[1] + door / 2), (b[0], b[1] + door / 2), WALL_COLOR))
+            # Corridor from the bottom doorway to the top doorway of the next room along y
+            if j + 1 < n:
+                nx, ny, nw, nh = rooms[i * n + j + 1]
+                a = (x + w / 2, y + h)
+                b = (nx + nw / 2, ny)
+                walls.append(geometry.Wall((a[0] - door / 2, a[1]), (b[0] - door / 2, b[1]), WALL_COLOR))
+                walls.append(geometry.Wall((a[0] + door / 2, a[1]), (b[0] + door / 2, b[1]), WALL_COLOR))
+    return trim(walls, wall_count, rng)
+
+
+def generate_clutter(wall_count, seed=0, density=1.0):
+    """
+    Generates randomly placed walls with random lengths, orientations and colors
+    :param wall_count: number of walls to generate
+    :param seed: random seed
+    :param density: average number of walls per 100x100 world units
+    :return: list of walls
+    """
+    rng = random.Random(seed)
+    spacing = get_spacing(density)
+    size = spacing * math.sqrt(wall_count)
+    walls = []
+    for _ in range(wall_count):
+        x = rng.uniform(0, size)
+        y = rng.uniform(0, size)
+        angle = rng.uniform(0, 2 * math.pi)
+        length = rng.uniform(0.2, 1.5) * spacing
+        color = (rng.randint(50, 255), rng.randint(50, 255), rng.randint(50, 255))
+        walls.append(geometry.Wall((x, y), (x + length * math.cos(angle), y + length * math.sin(angle)), color))
+    return walls
+
+
+def generate_pillars(circle_count, lo, hi, seed=0):
+    """
+    Scatters circular pillars over a box, such as the bounds of a generated layout
+    :param circle_count: number of circles to generate
+    :param lo: (min x, min y) corner of the box
+    :param hi: (max x, max y) corner of the box
+    :param seed: random seed
+    :return: list of circles
+    """
+    rng = random.Random(seed)
+    return [geometry.Circle((rng.uniform(lo[0], hi[0]), rng.uniform(lo[1], hi[1])), rng.uniform(2, 8), PILLAR_COLOR)
+            for _ in range(circle_count)]
+
+
+def split_doorway(p1, p2, door):
+    """
+    Splits a wall into two walls with a gap in the middle
+    :param door: width of the gap
+    :return: the two walls on either side of the gap
+    """
+    length = math.dist(p1, p2)
+    mid = ((p1[0] + p2[0]) / 2, (p1[1] + p2[1]) / 2)
+    dx = (p2[0] - p1[0]) / length * door / 2
+    dy = (p2[1] - p1[1]) / length * door / 2
+    return [geometry.Wall(p1, (mid[0] - dx, mid[1] - dy), ROOM_COLOR),
+            geometry.Wall((mid[0] + dx, mid[1] + dy), p2, ROOM_COLOR)]
+
+
+def trim(walls, wall_count, rng):
+    """
+    Randomly removes walls until there are exactly wall_count, keeping the original order
+    """
+    if len(walls) <= wall_count:
+        return walls
+    keep = set(rng.sample(range(len(walls)), wall_count))
+    return [w for i, w in enumerate(walls) if i in keep]
+
+
+GENERATORS = {
+    "maze": generate_maze,
+    "rooms": generate_rooms,
+    "clutter": generate_clutter
+}
+
+
+def generate(layout, wall_count, seed=0, density=1.0):
+    """
+    Generates a map by its layout name
+    :param layout: maze, rooms or clutter
+    :return: list of walls
+    """
+    return GENERATORS[layout](wall_count, seed, density)
+
+
+def save_walls(filename, walls, key="default", circles=None):
+    """
+    Saves walls, and optionally circles, in the WorldState file format
+    """
+    world_objects = pycaster.WorldState()
+    world_objects.add_walls(key, walls)
+    if circles:
+        world_objects.add_circles("pillars", circles)
+    world_objects.save_state(filename)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate large maps for stress testing the pycaster")
+    parser.add_argument("layout", choices=sorted(GENERATORS))
+    parser.add_argument("wall_count", type=int)
+    parser.add_argument("output")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--density", type=float, default=1.0, help="average walls per 100x100 world units")
+    parser.add_argument("--circles", type=int, default=0, help="number of circular pillars scattered over the map")
+    args = parser.parse_args()
+    walls = generate(args.layout, args.wall_count, args.seed, args.density)
+    xs = [p[0] for w in walls for p in (w.get_p1(), w.get_p2())]
+    ys = [p[1] for w in walls for p in (w.get_p1(), w.get_p2())]
+    save_walls(args.output, walls, circles=generate_pillars(args.circles, (min(xs), min(ys)), (max(xs), max(ys)), args.seed))
@@ -1,5 +1,7 @@
 import math
 
+import numpy as np
+
 
 def dist(p, q):
     return math.sqrt((q[0]-p[0])**2 + (q[1]-p[1])**2)
@@ -25,6 +27,231 @@ def intersect(l1, l2):
     return None
 
 
+def intersect_rays_walls(ray_p1, ray_p2, wall_p1, wall_p2, block_elements=2 ** 18):
+    """
+    Vectorized version of intersect() that solves every ray against every wall at once.
+    Walls are processed in blocks sized so each broadcast holds about block_elements ray/wall
+    pairs, which keeps the temporaries to a few tens of MB whatever the ray and wall counts.
+    :param ray_p1: (n, 2) array of ray start points
+    :param ray_p2: (n, 2) array of ray end points
+    :param wall_p1: (m, 2) array of wall start points
+    :param wall_p2: (m, 2) array of wall end points
+    :param block_elements: rough number of ray/wall pairs solved per broadcast
+    :return: (points, distances, indices, us) for the nearest hit of each ray, where u is the
+    position along the hit wall (0 - 1). Rays that hit nothing keep their end point, have a
+    distance of inf and an index of -1
+    """
+    ray_p1 = np.asarray(ray_p1, dtype=np.float64).reshape(-1, 2)
+    ray_p2 = np.asarray(ray_p2, dtype=np.float64).reshape(-1, 2)
+    wall_p1 = np.asarray(wall_p1, dtype=np.float64).reshape(-1, 2)
+    wall_p2 = np.asarray(wall_p2, dtype=np.float64).reshape(-1, 2)
+
+    n = len(ray_p1)
+    best_t = np.full(n, np.inf)
+    best_u = np.zeros(n)
+    indices = np.full(n, -1, dtype=np.int64)
+    block_size = max(1, block_elements // max(n, 1))
+
+    # Ray terms are shaped (n, 1) so they broadcast against (m,) wall terms
+    s1x = (ray_p2[:, 0] - ray_p1[:, 0])[:, None]
+    s1y = (ray_p2[:, 1] - ray_p1[:, 1])[:, None]
+    p0x = ray_p1[:, 0][:, None]
+    p0y = ray_p1[:, 1][:, None]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for start in range(0, len(wall_p1), block_size):
+            w1 = wall_p1[start:start + block_size]
+            w2 = wall_p2[start:start + block_size]
+            s2x = w2[:, 0] - w1[:, 0]
+            s2y = w2[:, 1] - w1[:, 1]
+            dx = p0x - w1[:, 0]
+            dy = p0y - w1[:, 1]
+
+            den = -s2x * s1y + s1x * s2y
+            s = (-s1y * dx + s1x * dy) / den
+            t = (s2x * dy - s2y * dx) / den
+
+            # Parallel lines give a zero denominator, which turns into nan/inf and fails the range test
+            hit = (den != 0) & (s >= 0) & (s <= 1) & (t >= 0) & (t <= 1)
+            t = np.where(hit, t, np.inf)
+
+            block_best = np.argmin(t, axis=1)
+            block_t = t[np.arange(n), block_best]
+            closer = block_t < best_t
+            best_t[closer] = block_t[closer]
+            best_u[closer] = s[np.arange(n), block_best][closer]
+            indices[closer] = block_best[closer] + start
+
+    hit = indices >= 0
+    t = np.where(hit, best_t, 1.0)
+    points = ray_p1 + (ray_p2 - ray_p1) * t[:, None]
+    distances = np.where(hit, best_t * np.hypot(ray_p2[:, 0] - ray_p1[:, 0], ray_p2[:, 1] - ray_p1[:, 1]), np.inf)
+    return points, distances, indices, best_u
+
+
+def intersect_rays_circles(ray_p1, ray_p2, centers, radii, block_elements=2 ** 18):
+    """
+    Finds where each ray first enters any circle, solving every ray against every circle at once.
+    The entry point is the smaller root of |p1 + t * (p2 - p1) - center| = r, so tangent rays hit
+    at their single touching point and zero-length rays never hit. Rays that start inside a circle
+    don't hit it.
+    :param ray_p1: (n, 2) array of ray start points
+    :param ray_p2: (n, 2) array of ray end points
+    :param centers: (m, 2) array of circle centers
+    :param radii: (m,) array of circle radii
+    :param block_elements: rough number of ray/circle pairs solved per broadcast, as in intersect_rays_walls
+    :return: (points, distances, indices, us) in the same form as intersect_rays_walls, where u is
+    the angle around the hit circle scaled to 0 - 1
+    """
+    ray_p1 = np.asarray(ray_p1, dtype=np.float64).reshape(-1, 2)
+    ray_p2 = np.asarray(ray_p2, dtype=np.float64).reshape(-1, 2)
+    centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+    radii = np.asarray(radii, dtype=np.float64).reshape(-1)
+
+    n = len(ray_p1)
+    best_t = np.full(n, np.inf)
+    indices = np.full(n, -1, dtype=np.int64)
+    block_size = max(1, block_elements // max(n, 1))
+
+    dx = (ray_p2[:, 0] - ray_p1[:, 0])[:, None]
+    dy = (ray_p2[:, 1] - ray_p1[:, 1])[:, None]
+    a = dx * dx + dy * dy
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for start in range(0, len(centers), block_size):
+            c = centers[start:start + block_size]
+            r = radii[start:start + block_size]
+            fx = ray_p1[:, 0][:, None] - c[:, 0]
+            fy = ray_p1[:, 1][:, None] - c[:, 1]
+            b = fx * dx + fy * dy
+            discriminant = b * b - a * (fx * fx + fy * fy - r * r)
+            t = (-b - np.sqrt(discriminant)) / a
+
+            # Misses give a negative discriminant and zero-length rays a zero a, both fail the range test as nan
+            t = np.where((t >= 0) & (t <= 1), t, np.inf)
+
+            block_best = np.argmin(t, axis=1)
+            block_t = t[np.arange(n), block_best]
+            closer = block_t < best_t
+            best_t[closer] = block_t[closer]
+            indices[closer] = block_best[closer] + start
+
+    hit = indices >= 0
+    t = np.where(hit, best_t, 1.0)
+    points = ray_p1 + (ray_p2 - ray_p1) * t[:, None]
+    distances = np.where(hit, t * np.sqrt(a[:, 0]), np.inf)
+    us = np.zeros(n)
+    if hit.any():
+        hit_centers = centers[indices[hit]]
+        us[hit] = (np.arctan2(points[hit, 1] - hit_centers[:, 1], points[hit, 0] - hit_centers[:, 0]) / (2 * np.pi)) % 1
+    return points, distances, indices, us
+
+
+def sweep_circle(p1, p2, radius, wall_p1, wall_p2, centers, radii):
+    """
+    Finds the first contact of a circle moving in a straight line against walls and circles. Each
+    wall is treated as a capsule of the moving circle's radius, its two sides plus a round cap on
+    each end, and each circle as one grown by the moving circle's radius, so the moving circle is
+    reduced to a point. Contacts the circle already overlaps at p1, or is moving away from, are ignored.
+    :param p1: start of the movement
+    :param p2: end of the movement
+    :param radius: radius of the moving circle
+    :param wall_p1: (m, 2) array of wall start points
+    :param wall_p2: (m, 2) array of wall end points
+    :param centers: (k, 2) array of circle centers
+    :param radii: (k,) array of circle radii
+    :return: (t, normal) of the nearest contact, where t is the position along the movement (0 - 1)
+    and normal is the unit vector pointing from the obstacle to the circle, or None if nothing is hit
+    """
+    wall_p1 = np.asarray(wall_p1, dtype=np.float64).reshape(-1, 2)
+    wall_p2 = np.asarray(wall_p2, dtype=np.float64).reshape(-1, 2)
+    centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+    radii = np.asarray(radii, dtype=np.float64).reshape(-1)
+    ox, oy = p1
+    dx, dy = p2[0] - ox, p2[1] - oy
+    best_t = math.inf
+    normal = None
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if len(wall_p1):
+            # Sides: the signed distance from each wall's line changes linearly along the movement
+            sx = wall_p2[:, 0] - wall_p1[:, 0]
+            sy = wall_p2[:, 1] - wall_p1[:, 1]
+            length = np.hypot(sx, sy)
+            nx = -sy / length
+            ny = sx / length
+            h0 = (ox - wall_p1[:, 0]) * nx + (oy - wall_p1[:, 1]) * ny
+            hd = dx * nx + dy * ny
+            side = np.sign(h0)
+            t = (side * radius - h0) / hd
+            cx = ox + dx * t - wall_p1[:, 0]
+            cy = oy + dy * t - wall_p1[:, 1]
+            u = (cx * sx + cy * sy) / (length * length)
+            hit = (np.abs(h0) >= radius) & (hd * side < 0) & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+            if hit.any():
+                i = int(np.argmin(np.where(hit, t, np.inf)))
+                best_t = float(t[i])
+                normal = (float(nx[i] * side[i]), float(ny[i] * side[i]))
+
+        # Caps on the wall ends and the grown circles are both circles to a point
+        cap_centers = np.concatenate((wall_p1, wall_p2, centers))
+        cap_radii = np.concatenate((np.full(2 * len(wall_p1), radius), radii + radius))
+        if len(cap_centers):
+            points, distances, indices, us = intersect_rays_circles([p1], [p2], cap_centers, cap_radii)
+            move_length = math.hypot(dx, dy)
+            if indices[0] >= 0 and distances[0] / move_length < best_t:
+                best_t = float(distances[0] / move_length)
+                center = cap_centers[indices[0]]
+                nx, ny = points[0] - center
+                n_length = math.hypot(nx, ny)
+                normal = (float(nx / n_length), float(ny / n_length))
+
+    if normal is None:
+        return None
+    return best_t, normal
+
+
+def segment_box_intersect(p1, p2, lo, hi):
+    """
+    Determines if a line segment passes through an axis-aligned box (Liang-Barsky clipping)
+    :param p1: start of the segment
+    :param p2: end of the segment
+    :param lo: (min x, min y) corner of the box
+    :param hi: (max x, max y) corner of the box
+    :return: true if any part of the segment is inside the box
+    """
+    t0, t1 = 0.0, 1.0
+    d = (p2[0] - p1[0], p2[1] - p1[1])
+    for axis in range(2):
+        if d[axis] == 0:
+            if p1[axis] < lo[axis] or p1[axis] > hi[axis]:
+                return False
+            continue
+        ta = (lo[axis] - p1[axis]) / d[axis]
+        tb = (hi[axis] - p1[axis]) / d[axis]
+        if ta > tb:
+            ta, tb = tb, ta
+        t0 = max(t0, ta)
+        t1 = min(t1, tb)
+        if t0 > t1:
+            return False
+    return True
+
+
+def circle_box_intersect(center, r, lo, hi):
+    """
+    Determines if a circle overlaps an axis-aligned box
+    :param center: center of the circle
+    :param r: radius of the circle
+    :param lo: (min x, min y) corner of the box
+    :param hi: (max x, max y) corner of the box
+    :return: true if any part of the circle is inside the box
+    """
+    dx = center[0] - min(max(center[0], lo[0]), hi[0])
+    dy = center[1] - min(max(center[1], lo[1]), hi[1])
+    return dx * dx + dy * dy <= r * r
+
+
 # Thanks to this magnificent person:
 # https://stackoverflow.com/questions/30844482/what-is-most-efficient-way-to-find-the-intersection-of-a-line-and-a-circle-in-py
 # Adapted to work with the current codebase
@@ -114,12 +341,16 @@ def line_point(l1, p):
 
 
 def length(l1):
+    if isinstance(l1, WallView):
+        return l1.get_length()
     p1 = l1.get_p1()
     p2 = l1.get_p2()
     return math.sqrt(math.pow(p2[0] - p1[0], 2) + math.pow(p2[1] - p1[1], 2))
 
 
 class Line:
+    __slots__ = ("p1", "p2")
+
     def __init__(self, p1, p2):
         self.p1 = p1
         self.p2 = p2
@@ -138,6 +369,8 @@ class Line:
 
 
 class Circle:
+    __slots__ = ("p1", "r", "color", "width", "selected")
+
     def __init__(self, p1, r, color):
         self.p1 = p1
         self.r = r
@@ -181,6 +414,8 @@ class Circle:
 
 
 class Wall(Line):
+    __slots__ = ("color", "width", "selected")
+
     def __init__(self, p1, p2, color):
         self.color = color
         self.width = 1
@@ -210,7 +445,266 @@ class Wall(Line):
         return self.selected
 
 
+class WallTable:
+    """
+    Stores walls as rows of contiguous arrays: endpoints, colors, widths and flags, plus the
+    direction, length and bounding box of each wall computed when it is inserted. Kernels work on
+    the arrays directly, and code that wants objects gets a WallView per row. Rows of removed walls
+    are reused by later inserts.
+    """
+
+    def __init__(self, capacity=64):
+        """
+        :param capacity: number of rows allocated up front, the table doubles when it fills up
+        """
+        self.p1 = np.zeros((capacity, 2))
+        self.p2 = np.zeros((capacity, 2))
+        self.directions = np.zeros((capacity, 2))
+        self.lengths = np.zeros(capacity)
+        # (min x, min y, max x, max y) of each wall
+        self.bounds = np.zeros((capacity, 4))
+        self.colors = np.zeros((capacity, 3), dtype=np.uint8)
+        self.widths = np.ones(capacity, dtype=np.int32)
+        self.flags = np.zeros(capacity, dtype=np.uint8)
+        # View of each row, None for free rows
+        self.views = [None] * capacity
+        # Rows below size have been used, free holds the ones that were removed since
+        self.size = 0
+        self.free = []
+        # Object that indexes the walls, e.g. a WorldState. Views move and recolor their walls through
+        # its set_wall_endpoints and set_object_color so it can keep its index and versions up to date
+        self.owner = None
+
+    def grow(self):
+        capacity = len(self.views) * 2
+        for name in ("p1", "p2", "directions", "lengths", "bounds", "colors", "widths", "flags"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+        self.views += [None] * (capacity - len(self.views))
+
+    def add(self, p1, p2, color, width=1, selected=False):
+        """
+        Inserts a wall
+        :return: WallView of the new row
+        """
+        if self.free:
+            row = self.free.pop()
+        else:
+            if self.size == len(self.views):
+                self.grow()
+            row = self.size
+            self.size += 1
+        view = WallView(self, row)
+        self.views[row] = view
+        self.colors[row] = color
+        self.widths[row] = width
+        self.flags[row] = WALL_ACTIVE | (WALL_SELECTED if selected else 0)
+        self.set_endpoints(row, p1, p2)
+        return view
+
+    def add_many(self, p1s, p2s, colors):
+        """
+        Inserts walls from arrays in one go. Free rows are filled first, like add does
+        :param p1s: (n, 2) start points
+        :param p2s: (n, 2) end points
+        :param colors: (n, 3) colors
+        :return: list of WallViews of the new rows
+        """
+        n = len(p1s)
+        reused = min(n, len(self.free))
+        if reused:
+            # Same rows add would pop, last freed first
+            rows = np.array(self.free[:-reused - 1:-1], dtype=np.intp)
+            del self.free[-reused:]
+        else:
+            rows = np.empty(0, dtype=np.intp)
+        fresh = n - reused
+        while self.size + fresh > len(self.views):
+            self.grow()
+        rows = np.concatenate((rows, np.arange(self.size, self.size + fresh, dtype=np.intp)))
+        self.size += fresh
+        self.p1[rows] = p1s
+        self.p2[rows] = p2s
+        self.directions[rows] = self.p2[rows] - self.p1[rows]
+        self.lengths[rows] = np.hypot(self.directions[rows, 0], self.directions[rows, 1])
+        self.bounds[rows, :2] = np.minimum(self.p1[rows], self.p2[rows])
+        self.bounds[rows, 2:] = np.maximum(self.p1[rows], self.p2[rows])
+        self.colors[rows] = colors
+        self.widths[rows] = 1
+        self.flags[rows] = WALL_ACTIVE
+        views = []
+        for row in rows.tolist():
+            view = WallView(self, row)
+            self.views[row] = view
+            views.append(view)
+        return views
+
+    def add_wall(self, wall):
+        """
+        Inserts a copy of a Wall or WallView
+        :return: WallView of the new row
+        """
+        return self.add(wall.get_p1(), wall.get_p2(), wall.get_color(), wall.get_width(), wall.get_selected())
+
+    def remove(self, view):
+        """
+        Frees a wall's row. The view is detached with a copy of the wall, so anything still holding
+        it keeps seeing the same wall
+        """
+        row = view.row
+        wall = Wall(view.get_p1(), view.get_p2(), view.get_color())
+        wall.width = int(self.widths[row])
+        wall.selected = bool(self.flags[row] & WALL_SELECTED)
+        view.detach(wall)
+        self.views[row] = None
+        self.flags[row] = 0
+        self.free.append(row)
+
+    def set_endpoints(self, row, p1, p2):
+        self.p1[row] = p1
+        self.p2[row] = p2
+        self.directions[row] = self.p2[row] - self.p1[row]
+        self.lengths[row] = math.hypot(self.directions[row, 0], self.directions[row, 1])
+        self.bounds[row, :2] = np.minimum(self.p1[row], self.p2[row])
+        self.bounds[row, 2:] = np.maximum(self.p1[row], self.p2[row])
+
+    def get_rows(self, walls):
+        """
+        :param walls: list of WallViews in this table
+        :return: array of their rows
+        """
+        return np.fromiter((w.row for w in walls), dtype=np.int64, count=len(walls))
+
+    def get_active_rows(self):
+        return np.flatnonzero(self.flags[:self.size] & WALL_ACTIVE)
+
+    def get_views(self):
+        return [self.views[row] for row in self.get_active_rows().tolist()]
+
+    def __len__(self):
+        return self.size - len(self.free)
+
+
+# WallTable flags
+WALL_ACTIVE = 1
+WALL_SELECTED = 2
+
+
+class WallView:
+    """
+    Wall-like view of one row of a WallTable. Once its wall is removed from the table the view is
+    detached, and reads and writes a copy of the wall instead
+    """
+    __slots__ = ("table", "row", "wall")
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+        # Copy of the wall once it has been removed from the table, None while attached
+        self.wall = None
+
+    def detach(self, wall):
+        """
+        :param wall: Wall holding the values of the removed row
+        """
+        self.table = None
+        self.row = -1
+        self.wall = wall
+
+    def is_detached(self):
+        return self.wall is not None
+
+    def get_p1(self):
+        if self.wall is not None:
+            return self.wall.get_p1()
+        x, y = self.table.p1[self.row].tolist()
+        return x, y
+
+    def set_p1(self, p1):
+        self.set_endpoints(p1, self.get_p2())
+
+    def get_p2(self):
+        if self.wall is not None:
+            return self.wall.get_p2()
+        x, y = self.table.p2[self.row].tolist()
+        return x, y
+
+    def set_p2(self, p2):
+        self.set_endpoints(self.get_p1(), p2)
+
+    def set_endpoints(self, p1, p2):
+        if self.wall is not None:
+            self.wall.set_p1(p1)
+            self.wall.set_p2(p2)
+        elif self.table.owner is not None:
+            self.table.owner.set_wall_endpoints(self, p1, p2)
+        else:
+            self.table.set_endpoints(self.row, p1, p2)
+
+    def get_direction(self):
+        if self.wall is not None:
+            (x1, y1), (x2, y2) = self.wall.get_p1(), self.wall.get_p2()
+            return x2 - x1, y2 - y1
+        x, y = self.table.directions[self.row].tolist()
+        return x, y
+
+    def get_length(self):
+        if self.wall is not None:
+            return dist(self.wall.get_p1(), self.wall.get_p2())
+        return float(self.table.lengths[self.row])
+
+    def get_bounds(self):
+        if self.wall is not None:
+            (x1, y1), (x2, y2) = self.wall.get_p1(), self.wall.get_p2()
+            return min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)
+        return tuple(self.table.bounds[self.row].tolist())
+
+    def get_color(self):
+        if self.wall is not None:
+            return self.wall.get_color()
+        return tuple(self.table.colors[self.row].tolist())
+
+    def set_color(self, color):
+        if self.wall is not None:
+            self.wall.set_color(color)
+        elif self.table.owner is not None:
+            self.table.owner.set_object_color(self, color)
+        else:
+            self.table.colors[self.row] = color
+
+    def get_width(self):
+        if self.wall is not None:
+            return self.wall.get_width()
+        return int(self.table.widths[self.row])
+
+    def set_width(self, width):
+        if self.wall is not None:
+            self.wall.set_width(width)
+        else:
+            self.table.widths[self.row] = width
+
+    def get_wall(self):
+        return self.get_color(), self.get_p1(), self.get_p2(), self.get_width()
+
+    def set_selected(self, selected):
+        if self.wall is not None:
+            self.wall.set_selected(selected)
+        elif selected:
+            self.table.flags[self.row] |= WALL_SELECTED
+        else:
+            self.table.flags[self.row] &= ~np.uint8(WALL_SELECTED)
+
+    def get_selected(self):
+        if self.wall is not None:
+            return self.wall.get_selected()
+        return bool(self.table.flags[self.row] & WALL_SELECTED)
+
+
 class Ray(Line):
+    __slots__ = ("rd", "color", "wall_height", "collide")
+
     def __init__(self, p1, p2, color, rd):
         # Rotation delta in radians, used for rays
         self.rd = rd
@@ -0,0 +1,91 @@
+import math
+import os
+import sys
+
+# Lets pygame load without a display, it has to be set before pygame is first imported
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import numpy as np
+
+import pycaster
+import renderer
+
+
+class HeadlessCaster:
+    """
+    Runs the pycaster without a window or event loop. Frames are rendered into an in-memory pixel
+    array, so this can be used in CI, worker processes and on servers without a display.
+    """
+
+    def __init__(self, width, height, wall_height, map_file=None, position=(0, 0),
+                 sky_color=(0, 0, 0), ground_color=(0, 0, 0)):
+        """
+        :param width: width of the rendered image
+        :param height: height of the rendered image
+        :param wall_height: height scalar of each projected wall
+        :param map_file: map to load into the world, leave empty to start with no walls
+        :param position: starting camera position
+        :param sky_color: color above the horizon
+        :param ground_color: color below the horizon
+        """
+        self.engine = pycaster.Engine(width, height, wall_height, position)
+        world_objects = pycaster.WorldState()
+        if map_file is not None:
+            world_objects.load_state(map_file)
+        self.engine.set_world_objects(world_objects)
+        self.renderer = renderer.FramebufferRenderer(width, height, sky_color, ground_color)
+
+    def step(self, position, rotation_delta):
+        """
+        Renders the frame seen from a camera pose
+        :param position: camera position
+        :param rotation_delta: camera rotation in radians
+        :return: FrameState, which is reused by later steps
+        """
+        return self.engine.step(position, rotation_delta)
+
+    def render(self, position, rotation_delta):
+        """
+        Renders the image seen from a camera pose
+        :param position: camera position
+        :param rotation_delta: camera rotation in radians
+        :return: (height, width, 3) uint8 RGB image
+        """
+        return to_rgb(self.renderer.fill(self.step(position, rotation_delta)))
+
+    def get_engine(self):
+        return self.engine
+
+    def get_renderer(self):
+        return self.renderer
+
+    def get_world_state(self):
+        return self.engine.get_world_state()
+
+
+def to_rgb(pixels):
+    """
+    Converts a (width, height) array of packed 0xRRGGBB pixels into a (height, width, 3) RGB image
+    """
+    pixels = pixels.T
+    rgb = np.empty(pixels.shape + (3,), dtype=np.uint8)
+    rgb[:, :, 0] = pixels >> 16
+    rgb[:, :, 1] = pixels >> 8
+    rgb[:, :, 2] = pixels
+    return rgb
+
+
+def write_ppm(filename, rgb):
+    """
+    Saves an RGB image as a binary PPM, which needs nothing but numpy
+    """
+    with open(filename, 'wb') as file:
+        file.write(b"P6\n%d %d\n255\n" % (rgb.shape[1], rgb.shape[0]))
+        file.write(np.ascontiguousarray(rgb).tobytes())
+
+
+if __name__ == "__main__":
+    # Usage: python headless.py <map> <x> <y> <rotation in degrees> <output.ppm>
+    map_file, x, y, rotation, output = sys.argv[1:6]
+    caster = HeadlessCaster(800, 600, 1000, map_file)
+    write_ppm(output, caster.render((float(x), float(y)), float(rotation) * (math.pi / 180)))
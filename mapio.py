@@ -0,0 +1,463 @@
+"""
+Map file formats for the pycaster.
+
+A map file is a fixed-size header followed by a group name table and typed wall and circle arrays.
+The arrays are stored exactly as they sit in memory, so a map opens with numpy.memmap and no
+parsing, however large it is.
+
+Layout (little-endian):
+    header       MAGIC, format version, group count, wall count, circle count and the byte offsets
+                 of the group table, wall array and circle array
+    group table  for each group, a uint16 byte length followed by the UTF-8 name
+    walls        WALL_DTYPE records
+    circles      CIRCLE_DTYPE records
+
+The text format has one object per line, "group: (x1, y1); (x2, y2); (r, g, b)" for walls and
+"group: (x, y); radius; (r, g, b)" for circles. It is parsed with a strict tokenizer, never eval.
+
+Usage:
+    python mapio.py <map.txt> <map.pcmap>      convert a text map to a binary map
+    python mapio.py <map.pcmap> <map.txt>      convert a binary map back to text
+    python mapio.py --throughput <map.txt>     measure text load and save speed in lines per second
+"""
+import math
+import os
+import re
+import struct
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+MAGIC = b"PYCMAP\0\0"
+FORMAT_VERSION = 1
+EXTENSION = ".pcmap"
+
+# magic, version, group count, wall count, circle count, group table offset, walls offset, circles offset
+HEADER = struct.Struct("<8sIIQQQQQ")
+
+WALL_DTYPE = np.dtype([
+    ("p1", "<f8", (2,)),
+    ("p2", "<f8", (2,)),
+    ("group", "<u4"),
+    ("color", "u1", (3,)),
+    ("flags", "u1")
+])
+
+CIRCLE_DTYPE = np.dtype([
+    ("center", "<f8", (2,)),
+    ("r", "<f8"),
+    ("group", "<u4"),
+    ("color", "u1", (3,)),
+    ("flags", "u1")
+])
+
+
+class MapFile:
+    """
+    An opened binary map. The wall and circle arrays are memory-mapped, so they are only read
+    from disk as they are used
+    """
+
+    def __init__(self, group_names, walls, circles):
+        self.group_names = group_names
+        self.walls = walls
+        self.circles = circles
+
+    def get_group_names(self):
+        return self.group_names
+
+    def get_walls(self):
+        """
+        :return: WALL_DTYPE array of every wall
+        """
+        return self.walls
+
+    def get_circles(self):
+        """
+        :return: CIRCLE_DTYPE array of every circle
+        """
+        return self.circles
+
+    def get_group_walls(self):
+        """
+        :return: dict of group name -> WALL_DTYPE array of the group's walls
+        """
+        return split_groups(self.walls, self.group_names)
+
+    def get_group_circles(self):
+        """
+        :return: dict of group name -> CIRCLE_DTYPE array of the group's circles
+        """
+        return split_groups(self.circles, self.group_names)
+
+
+def split_groups(records, group_names):
+    groups = {}
+    if len(records) == 0:
+        return groups
+    # A stable sort keeps each group's records in file order
+    order = np.argsort(records["group"], kind="stable")
+    records = records[order]
+    bounds = np.flatnonzero(np.diff(records["group"])) + 1
+    for chunk in np.split(records, bounds):
+        groups[group_names[int(chunk["group"][0])]] = chunk
+    return groups
+
+
+def align(offset):
+    return (offset + 7) // 8 * 8
+
+
+def is_binary_map(filename):
+    """
+    :return: True if the file starts with the binary map magic
+    """
+    try:
+        with open(filename, 'rb') as file:
+            return file.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def load_map(filename):
+    """
+    Opens a binary map without parsing it
+    :param filename: map file
+    :return: MapFile
+    """
+    with open(filename, 'rb') as file:
+        header = file.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError(f"{filename} is too short to be a map file")
+        magic, version, group_count, wall_count, circle_count, groups_offset, walls_offset, circles_offset = \
+            HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError(f"{filename} is not a binary map file")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"{filename} has unsupported map format version {version}")
+
+        file.seek(groups_offset)
+        group_names = []
+        for _ in range(group_count):
+            length, = struct.unpack("<H", file.read(2))
+            group_names.append(file.read(length).decode("utf-8"))
+
+    walls = np.zeros(0, dtype=WALL_DTYPE)
+    circles = np.zeros(0, dtype=CIRCLE_DTYPE)
+    if wall_count:
+        walls = np.memmap(filename, dtype=WALL_DTYPE, mode='r', offset=walls_offset, shape=(wall_count,))
+    if circle_count:
+        circles = np.memmap(filename, dtype=CIRCLE_DTYPE, mode='r', offset=circles_offset, shape=(circle_count,))
+    return MapFile(group_names, walls, circles)
+
+
+def save_map(filename, group_names, walls, circles=None):
+    """
+    Writes a binary map
+    :param group_names: list of group names, indexed by the group field of the records
+    :param walls: WALL_DTYPE array
+    :param circles: CIRCLE_DTYPE array
+    """
+    if circles is None:
+        circles = np.zeros(0, dtype=CIRCLE_DTYPE)
+    group_table = b"".join(struct.pack("<H", len(name.encode("utf-8"))) + name.encode("utf-8")
+                           for name in group_names)
+    groups_offset = HEADER.size
+    walls_offset = align(groups_offset + len(group_table))
+    circles_offset = align(walls_offset + walls.nbytes)
+    with open(filename, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(group_names), len(walls), len(circles),
+                               groups_offset, walls_offset, circles_offset))
+        file.write(group_table)
+        file.write(b"\0" * (walls_offset - groups_offset - len(group_table)))
+        file.write(np.ascontiguousarray(walls, dtype=WALL_DTYPE).tobytes())
+        file.write(b"\0" * (circles_offset - walls_offset - walls.nbytes))
+        file.write(np.ascontiguousarray(circles, dtype=CIRCLE_DTYPE).tobytes())
+
+
+def make_walls(group_walls, group_names):
+    """
+    Packs walls into a record array
+    :param group_walls: dict of group name -> list of wall-like objects with get_p1, get_p2 and get_color
+    :param group_names: list of group names, extended with any group not already in it
+    :return: WALL_DTYPE array
+    """
+    count = sum(len(walls) for walls in group_walls.values())
+    records = np.zeros(count, dtype=WALL_DTYPE)
+    i = 0
+    for name, walls in group_walls.items():
+        if name not in group_names:
+            group_names.append(name)
+        n = len(walls)
+        records["p1"][i:i + n] = [w.get_p1() for w in walls]
+        records["p2"][i:i + n] = [w.get_p2() for w in walls]
+        records["color"][i:i + n] = [w.get_color() for w in walls]
+        records["group"][i:i + n] = group_names.index(name)
+        i += n
+    return records
+
+
+def make_circles(group_circles, group_names):
+    """
+    Packs circles into a record array
+    :param group_circles: dict of group name -> list of circles
+    :param group_names: list of group names, extended with any group not already in it
+    :return: CIRCLE_DTYPE array
+    """
+    count = sum(len(circles) for circles in group_circles.values())
+    records = np.zeros(count, dtype=CIRCLE_DTYPE)
+    i = 0
+    for name, circles in group_circles.items():
+        if name not in group_names:
+            group_names.append(name)
+        n = len(circles)
+        records["center"][i:i + n] = [c.get_p1() for c in circles]
+        records["r"][i:i + n] = [c.get_r() for c in circles]
+        records["color"][i:i + n] = [c.get_color() for c in circles]
+        records["group"][i:i + n] = group_names.index(name)
+        i += n
+    return records
+
+
+# Decimal int or float literal. Unlike float(), this rejects nan, inf and underscores
+NUMBER = re.compile(r"[+-]?\d+|[+-]?(?:\d+\.\d*|\.\d+|\d+(?=[eE]))(?:[eE][+-]?\d+)?", re.ASCII)
+
+_NUM = r"\s*([+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)\s*"
+_INT = r"\s*(\d+)\s*"
+# A wall line as the writer produces it. Its tokens all match NUMBER, so it never needs parse_line
+WALL_LINE = re.compile(rf"([^:]*):\s*\({_NUM},{_NUM}\)\s*;\s*\({_NUM},{_NUM}\)\s*;\s*\({_INT},{_INT},{_INT}\)\s*",
+                       re.ASCII)
+
+
+def parse_number(token, line_number):
+    """
+    :param token: an int or float literal
+    :return: int or float
+    """
+    token = token.strip()
+    if NUMBER.fullmatch(token) is None:
+        raise ValueError(f"line {line_number}: expected a number, got {token!r}")
+    if token.lstrip('+-').isdigit():
+        return int(token)
+    value = float(token)
+    if not math.isfinite(value):
+        raise ValueError(f"line {line_number}: number out of range {token!r}")
+    return value
+
+
+def parse_tuple(text, size, line_number):
+    """
+    Parses a parenthesized tuple of numbers such as "(1.5, 2)"
+    :param size: number of elements the tuple must have
+    :return: tuple of ints and floats
+    """
+    text = text.strip()
+    if len(text) < 2 or text[0] != '(' or text[-1] != ')':
+        raise ValueError(f"line {line_number}: expected a tuple, got {text!r}")
+    tokens = text[1:-1].split(',')
+    if len(tokens) != size:
+        raise ValueError(f"line {line_number}: expected {size} values, got {text!r}")
+    return tuple(parse_number(token, line_number) for token in tokens)
+
+
+def parse_color(text, line_number):
+    """
+    Parses an "(r, g, b)" color, each component between 0 and 255
+    :return: tuple of 3 ints or floats
+    """
+    color = parse_tuple(text, 3, line_number)
+    if not all(0 <= c <= 255 for c in color):
+        raise ValueError(f"line {line_number}: color out of range {text.strip()!r}")
+    return color
+
+
+def parse_line(line, line_number=0):
+    """
+    Parses one line of a text map. Walls are "group: (x1, y1); (x2, y2); (r, g, b)" and circles are
+    "group: (x, y); radius; (r, g, b)"
+    :param line: line of the file
+    :param line_number: used in error messages
+    :return: ("wall", group, p1, p2, color), ("circle", group, center, r, color) or None for a blank line
+    """
+    if not line.strip():
+        return None
+    key, sep, vals = line.partition(':')
+    vals = vals.split(';')
+    if not sep or len(vals) != 3:
+        raise ValueError(f"line {line_number}: expected 'group: value; value; value', got {line.strip()!r}")
+    color = parse_color(vals[2], line_number)
+    if vals[1].strip().startswith('('):
+        return "wall", key, parse_tuple(vals[0], 2, line_number), parse_tuple(vals[1], 2, line_number), color
+    return "circle", key, parse_tuple(vals[0], 2, line_number), parse_number(vals[1], line_number), color
+
+
+def iter_text_map(filename):
+    """
+    Reads a text map one line at a time
+    :return: iterator of parsed lines, see parse_line
+    """
+    with open(filename, 'r') as file:
+        for line_number, line in enumerate(file, 1):
+            entry = parse_line(line, line_number)
+            if entry is not None:
+                yield entry
+
+
+def read_text_arrays(filename):
+    """
+    Bulk reads a text map into record arrays in one pass. Walls in the form the writer produces are
+    matched with one regular expression and converted a column at a time, anything else goes
+    through parse_line
+    :return: (group names, WALL_DTYPE array, CIRCLE_DTYPE array)
+    """
+    group_names = []
+    groups = {}
+    wall_groups = []
+    wall_fields = []
+    wall_lines = []
+    circles = []
+    with open(filename, 'r') as file:
+        lines = file.read().split('\n')
+    for line_number, line in enumerate(lines, 1):
+        match = WALL_LINE.fullmatch(line)
+        if match is not None:
+            entry = ("wall", match.group(1), match.groups()[1:])
+        else:
+            entry = parse_line(line, line_number)
+            if entry is None:
+                continue
+        key = entry[1]
+        if key not in groups:
+            groups[key] = len(group_names)
+            group_names.append(key)
+        if entry[0] == "circle":
+            circles.append((entry[2], entry[3], groups[key], entry[4], 0))
+            continue
+        wall_groups.append(groups[key])
+        wall_fields.append(entry[2] if match is not None else entry[2] + entry[3] + entry[4])
+        wall_lines.append(line_number)
+
+    walls = np.zeros(len(wall_groups), dtype=WALL_DTYPE)
+    if wall_groups:
+        # float() of every matched token, done by numpy for the whole file at once
+        values = np.array(wall_fields).astype(np.float64)
+        finite = np.isfinite(values).all(axis=1)
+        if not finite.all():
+            raise ValueError(f"line {wall_lines[int(np.flatnonzero(~finite)[0])]}: number out of range")
+        # Colors are stored as bytes, so anything above 255 would silently wrap
+        bad = (values[:, 4:7] > 255).any(axis=1)
+        if bad.any():
+            i = int(np.flatnonzero(bad)[0])
+            raise ValueError(f"line {wall_lines[i]}: color out of range {lines[wall_lines[i] - 1].split(';')[-1].strip()!r}")
+        walls["p1"] = values[:, 0:2]
+        walls["p2"] = values[:, 2:4]
+        walls["color"] = values[:, 4:7]
+        walls["group"] = wall_groups
+    return group_names, walls, np.array(circles, dtype=CIRCLE_DTYPE)
+
+
+class TextMapWriter:
+    """
+    Writes a text map line by line through a buffered file, so saving takes time in proportion to
+    the size of the map. Values are written as they are passed in. Walls in a WorldState are held as
+    floats, so a map with integer coordinates is saved back as e.g. "(1.0, 2.0)", which loads to the
+    same walls
+    """
+
+    def __init__(self, filename, buffer_size=2 ** 16):
+        self.file = open(filename, 'w', buffering=buffer_size)
+        self.line_count = 0
+
+    def write_line(self, line):
+        # No newline after the last line, to match the files the game has always written
+        if self.line_count:
+            self.file.write('\n')
+        self.file.write(line)
+        self.line_count += 1
+
+    def write_wall(self, key, p1, p2, color):
+        self.write_line("{0}: {1}; {2}; {3}".format(key, tuple(p1), tuple(p2), tuple(color)))
+
+    def write_circle(self, key, center, r, color):
+        self.write_line("{0}: {1}; {2}; {3}".format(key, tuple(center), r, tuple(color)))
+
+    def get_line_count(self):
+        return self.line_count
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+def write_text_map(filename, map_file):
+    """
+    Writes a binary map in the text format
+    :param map_file: MapFile
+    :return: number of lines written
+    """
+    names = map_file.get_group_names()
+    walls = map_file.get_walls()
+    circles = map_file.get_circles()
+    with TextMapWriter(filename) as writer:
+        for p1, p2, group, color in zip(walls["p1"].tolist(), walls["p2"].tolist(), walls["group"].tolist(),
+                                        walls["color"].tolist()):
+            writer.write_wall(names[group], p1, p2, color)
+        for center, r, group, color in zip(circles["center"].tolist(), circles["r"].tolist(),
+                                           circles["group"].tolist(), circles["color"].tolist()):
+            writer.write_circle(names[group], center, r, color)
+        return writer.get_line_count()
+
+
+def measure_throughput(filename, repeat=3):
+    """
+    Times reading and writing a text map
+    :return: dict of lines per second for streamed reads, bulk reads and writes
+    """
+    results = {}
+    start = time.perf_counter()
+    for _ in range(repeat):
+        lines = sum(1 for _ in iter_text_map(filename))
+    results["read_lines_per_sec"] = round(lines * repeat / (time.perf_counter() - start))
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        group_names, walls, circles = read_text_arrays(filename)
+    results["bulk_read_lines_per_sec"] = round(lines * repeat / (time.perf_counter() - start))
+
+    map_file = MapFile(group_names, walls, circles)
+    with tempfile.TemporaryDirectory() as directory:
+        out = os.path.join(directory, "throughput.txt")
+        start = time.perf_counter()
+        for _ in range(repeat):
+            write_text_map(out, map_file)
+        results["write_lines_per_sec"] = round(lines * repeat / (time.perf_counter() - start))
+    results["lines"] = lines
+    return results
+
+
+def convert(source, destination):
+    """
+    Converts a map between the text and binary formats, in whichever direction the source is in
+    """
+    if is_binary_map(source):
+        write_text_map(destination, load_map(source))
+    else:
+        save_map(destination, *read_text_arrays(source))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--throughput":
+        print(measure_throughput(sys.argv[2]))
+    elif len(sys.argv) == 3:
+        convert(sys.argv[1], sys.argv[2])
+    else:
+        print(__doc__)
+        sys.exit(1)
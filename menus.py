@@ -66,15 +66,23 @@ class GameHUDInterface(Interface):
         """
         debug_stats = self.get_debug_stats()
         cur_pos = debug_stats["cur_pos"]
+        frame_stats = debug_stats["frame_stats"]
         font_label = ['fps:{0}'.format(round(debug_stats["fps"], 1)),
-                      'x:{0} y:{1}'.format(round(cur_pos[0], 1), round(cur_pos[1], 1))]
+                      'x:{0} y:{1}'.format(round(cur_pos[0], 1), round(cur_pos[1], 1)),
+                      self.format_percentiles("frame", frame_stats.summarize("frame")),
+                      self.format_percentiles("interval", frame_stats.summarize("interval"))]
+        if debug_stats["is_frame_graph"]:
+            self.draw_frame_graph(s, frame_stats.get_samples("frame"))
         if debug_stats["is_detailed_debug"]:
-            debug_rays = debug_stats["debug_rays"]
-            for ray in debug_rays:
-                p1 = ray.get_p1()[0] + (self.width / 2), ray.get_p1()[1] + (self.height / 2)
-                p2 = ray.get_p2()[0] + (self.width / 2), ray.get_p2()[1] + (self.height / 2)
-                pygame.draw.line(s, ray.get_color(), p1, p2)
-                pygame.draw.circle(s, (0, 0, 255), p2, 5, 0)
+            ray_starts, ray_ends, ray_colors = debug_stats["debug_rays"]
+            offset = (self.width / 2, self.height / 2)
+            ray_starts = (ray_starts + offset).tolist()
+            ray_ends = (ray_ends + offset).tolist()
+            ray_colors = ray_colors.tolist()
+            for i in range(len(ray_starts)):
+                c = ray_colors[i]
+                pygame.draw.line(s, ((c >> 16) & 255, (c >> 8) & 255, c & 255), ray_starts[i], ray_ends[i])
+                pygame.draw.circle(s, (0, 0, 255), ray_ends[i], 5, 0)
             walls = debug_stats["debug_walls"]
             for k in walls:
                 for wall in walls[k]:
@@ -90,11 +98,46 @@ class GameHUDInterface(Interface):
                 for i in engine_debug[k]:
                     font_label.append(f'{i}: {engine_debug[k][i]}')
 
+            # Percentiles of every stage over the rolling window
+            font_label.append('')
+            font_label.append('[ms over last {0} frames]'.format(frame_stats.summarize("frame")["count"]))
+            for name in frame_stats.get_names():
+                if name not in ("frame", "interval"):
+                    font_label.append(self.format_percentiles(name, frame_stats.summarize(name)))
+
         font = pygame.font.SysFont('consolas.ttf', 24)
         for i in range(len(font_label)):
             text = font.render(font_label[i], True, (0, 255, 0))
             s.blit(text, (5, i * 20 + 5))
 
+    def format_percentiles(self, name, summary):
+        return '{0} p50:{1} p95:{2} p99:{3} max:{4}'.format(
+            name, round(summary["p50"], 2), round(summary["p95"], 2), round(summary["p99"], 2), round(summary["max"], 2))
+
+    def draw_frame_graph(self, s, samples, graph_width=240, graph_height=60, budget=1000 / 60):
+        """
+        Draws the most recent frame times as a bar graph in the bottom right corner, with a
+        line marking the frame budget
+        :param samples: frame times in ms, oldest first
+        :param budget: frame time in ms drawn as the reference line
+        """
+        left = self.width - graph_width - 5
+        bottom = self.height - 5
+        # Blit the backdrop from its own alpha surface, so it stays translucent whatever s is
+        backdrop = pygame.Surface((graph_width, graph_height), pygame.SRCALPHA)
+        backdrop.fill(pygame.Color(0, 0, 0, 150))
+        s.blit(backdrop, (left, bottom - graph_height))
+        samples = samples[-graph_width:]
+        if len(samples) == 0:
+            return
+        # Scale so the budget line sits halfway up unless a spike needs more room
+        scale = graph_height / max(budget * 2, samples.max())
+        for x, ms in enumerate(samples.tolist()):
+            color = (0, 255, 0) if ms <= budget else (255, 80, 0)
+            pygame.draw.line(s, color, (left + x, bottom), (left + x, bottom - ms * scale))
+        budget_y = bottom - budget * scale
+        pygame.draw.line(s, (255, 255, 255), (left, budget_y), (left + graph_width, budget_y))
+
 
 class StartMenuInterface(Interface):
     """
@@ -253,7 +296,9 @@ class PauseMenuInterface(Interface):
             "Left: A",
             "Right: D",
             "Save: O",
-            "Load: P"
+            "Load: P",
+            "Export Trace: T",
+            "Export Frame Stats: C"
 
         ]
 
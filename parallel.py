@@ -0,0 +1,361 @@
+"""
+Parallel ray casting for the pycaster.
+
+ProcessCaster splits the camera's columns into one tile per worker and casts them on a process
+pool. Wall and circle geometry lives in multiprocessing.shared_memory blocks that are only
+re-published when the world changes, and every frame the workers read the rays and candidate walls
+and circles from shared blocks and write their hits straight into a shared output buffer, so nothing but block
+names is pickled.
+
+ThreadCaster is the lighter alternative for medium workloads: fixed-size tiles of columns are cast
+on a thread pool with the NumPy kernel, which releases the GIL, into preallocated result arrays.
+"""
+import atexit
+import concurrent.futures
+import multiprocessing
+import os
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+import geometry
+
+# Columns of the shared hit buffer: distance, object row, u, hit x, hit y. Rows below the wall count
+# are walls, the rest are circles, and -1 is a miss
+HIT_COLUMNS = 5
+
+# Shared blocks this worker process is attached to, by name
+_attached = {}
+
+
+def attach_view(spec):
+    """
+    Maps a shared block in a worker process
+    :param spec: (block name, shape, dtype name)
+    :return: ndarray backed by the shared block
+    """
+    name, shape, dtype = spec
+    if name not in _attached:
+        _attached[name] = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=dtype, buffer=_attached[name].buf)
+
+
+def detach_stale(names):
+    """
+    Closes blocks the parent has replaced, so their memory can be freed
+    :param names: names of the blocks still in use
+    """
+    for name in list(_attached):
+        if name not in names:
+            _attached.pop(name).close()
+
+
+def cast_tile(task):
+    """
+    Casts one tile of columns inside a worker process and writes the hits into the shared hit buffer
+    :param task: (walls spec, circles spec, candidates spec, circle candidates spec, rays spec, hits spec,
+    first column, end column)
+    :return: time spent in the worker in ms
+    """
+    start_time = time.perf_counter()
+    specs = task[:6]
+    detach_stale({spec[0] for spec in specs})
+    walls, circles, candidates, circle_candidates, rays, hits = [attach_view(spec) for spec in specs]
+    start, stop = task[6:]
+
+    p1s = rays[start:stop, :2]
+    p2s = rays[start:stop, 2:]
+    out = hits[start:stop]
+    out[:, 0] = np.inf
+    out[:, 1] = -1
+
+    if len(candidates):
+        rows = walls[candidates]
+        points, distances, indices, us = geometry.intersect_rays_walls(p1s, p2s, rows[:, :2], rows[:, 2:])
+        hit = indices >= 0
+        out[hit, 0] = distances[hit]
+        out[hit, 1] = candidates[indices[hit]]
+        out[hit, 2] = us[hit]
+        out[hit, 3:] = points[hit]
+
+    if len(circle_candidates):
+        rows = circles[circle_candidates]
+        points, distances, indices, us = geometry.intersect_rays_circles(p1s, p2s, rows[:, :2], rows[:, 2])
+        closer = distances < out[:, 0]
+        out[closer, 0] = distances[closer]
+        out[closer, 1] = len(walls) + circle_candidates[indices[closer]]
+        out[closer, 2] = us[closer]
+        out[closer, 3:] = points[closer]
+
+    # Drop the views before the next task may close their blocks
+    del walls, circles, candidates, circle_candidates, rays, hits, p1s, p2s, out
+    return (time.perf_counter() - start_time) * 1000
+
+
+class SharedArray:
+    """
+    Growable array in a shared memory block. The block is only replaced when a larger array is
+    needed, so workers can keep their attachment between frames.
+    """
+
+    def __init__(self, columns, dtype):
+        """
+        :param columns: number of columns per row, or 0 for a flat array
+        :param dtype: numpy dtype of the array
+        """
+        self.columns = columns
+        self.dtype = np.dtype(dtype)
+        self.block = None
+        self.capacity = 0
+        self.length = 0
+        self.array = None
+
+    def resize(self, length):
+        """
+        Sets the number of rows, replacing the block if it is too small
+        :param length: number of rows
+        """
+        if length > self.capacity or self.block is None:
+            self.close()
+            self.capacity = max(length, self.capacity * 2, 16)
+            row_bytes = self.dtype.itemsize * max(self.columns, 1)
+            self.block = shared_memory.SharedMemory(create=True, size=self.capacity * row_bytes)
+        self.length = length
+        shape = (length, self.columns) if self.columns else (length,)
+        self.array = np.ndarray(shape, dtype=self.dtype, buffer=self.block.buf)
+
+    def get_array(self):
+        return self.array
+
+    def get_spec(self):
+        """
+        :return: (block name, shape, dtype name) for attach_view
+        """
+        return self.block.name, self.array.shape, self.dtype.str
+
+    def close(self):
+        self.array = None
+        if self.block is not None:
+            self.block.close()
+            self.block.unlink()
+            self.block = None
+
+
+class ProcessCaster:
+    """
+    Casts rays on a pool of worker processes against shared copies of the world's walls and circles
+    """
+
+    def __init__(self, workers=0):
+        """
+        :param workers: number of worker processes, 0 uses every core
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = None
+
+        # World the shared tables were published for, and whether its walls or circles have changed since.
+        # Recolors don't touch the tables, and removed walls are left in place but never offered as candidates
+        self.published = None
+        self.walls_stale = True
+        self.circles_stale = True
+        # Objects in shared table row order. Wall rows match the world's WallTable rows
+        self.wall_objects = []
+        self.circle_objects = []
+        # Circle -> shared table row
+        self.circle_rows = {}
+
+        self.walls = SharedArray(4, np.float64)
+        self.circles = SharedArray(3, np.float64)
+        self.candidates = SharedArray(0, np.int64)
+        self.circle_candidates = SharedArray(0, np.int64)
+        self.rays = SharedArray(4, np.float64)
+        self.hits = SharedArray(HIT_COLUMNS, np.float64)
+
+        # Time in ms each worker spent on its tile in the last cast
+        self.tile_times = []
+
+    def start(self):
+        # Workers must share the parent's resource tracker, otherwise each one starts its own and
+        # unlinks the shared blocks it attached to when it exits
+        resource_tracker.ensure_running()
+        # Fork where it is available so workers don't re-run the game's main module
+        if "fork" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("fork")
+        else:
+            context = multiprocessing.get_context()
+        self.pool = context.Pool(self.workers)
+        atexit.register(self.close)
+
+    def on_world_change(self, event, kind, key, objects):
+        if event == "recolor" or (event == "remove" and kind == "wall"):
+            return
+        if kind == "wall":
+            self.walls_stale = True
+        else:
+            self.circles_stale = True
+
+    def publish(self, world_objects):
+        """
+        Copies the world's walls and circles into the shared tables if they changed since they
+        were last published
+        :param world_objects: WorldState to publish
+        """
+        if self.published is not world_objects:
+            if self.published is not None:
+                self.published.remove_listener(self.on_world_change)
+            world_objects.add_listener(self.on_world_change)
+            self.published = world_objects
+            self.walls_stale = True
+            self.circles_stale = True
+
+        if self.walls_stale:
+            table = world_objects.get_wall_table()
+            self.walls.resize(table.size)
+            self.walls.get_array()[:, :2] = table.p1[:table.size]
+            self.walls.get_array()[:, 2:] = table.p2[:table.size]
+            self.wall_objects = table.views[:table.size]
+            self.walls_stale = False
+        if self.circles_stale:
+            circles = [c for k in world_objects.get_circles() for c in world_objects.get_circles()[k]]
+            self.circles.resize(len(circles))
+            for row, c in enumerate(circles):
+                self.circles.get_array()[row] = c.get_p1() + (c.get_r(),)
+            self.circle_objects = circles
+            self.circle_rows = {c: row for row, c in enumerate(circles)}
+            self.circles_stale = False
+
+    def cast(self, world_objects, p1s, p2s, walls, circles):
+        """
+        Finds the closest wall or circle hit by each ray
+        :param world_objects: WorldState the walls and circles belong to
+        :param p1s: (n, 2) ray start points
+        :param p2s: (n, 2) ray end points
+        :param walls: walls dictionary of candidate walls from the broad phase
+        :param circles: circles dictionary of candidate circles from the broad phase
+        :return: list of (column, distance, object, u, point) for every ray that hit something
+        """
+        if self.pool is None:
+            self.start()
+        self.publish(world_objects)
+
+        rows = world_objects.get_wall_table().get_rows([w for k in walls for w in walls[k]])
+        self.candidates.resize(len(rows))
+        self.candidates.get_array()[:] = rows
+        circle_rows = [self.circle_rows[c] for k in circles for c in circles[k]]
+        self.circle_candidates.resize(len(circle_rows))
+        self.circle_candidates.get_array()[:] = circle_rows
+        n = len(p1s)
+        self.rays.resize(n)
+        self.rays.get_array()[:, :2] = p1s
+        self.rays.get_array()[:, 2:] = p2s
+        self.hits.resize(n)
+
+        specs = (self.walls.get_spec(), self.circles.get_spec(), self.candidates.get_spec(),
+                 self.circle_candidates.get_spec(), self.rays.get_spec(), self.hits.get_spec())
+        bounds = np.linspace(0, n, min(self.workers, n) + 1).astype(int)
+        tasks = [specs + (int(bounds[i]), int(bounds[i + 1])) for i in range(len(bounds) - 1)]
+        self.tile_times = self.pool.map(cast_tile, tasks)
+
+        out = self.hits.get_array()
+        results = []
+        for i in np.flatnonzero(out[:, 1] >= 0).tolist():
+            distance, row, u, x, y = out[i].tolist()
+            row = int(row)
+            if row < len(self.wall_objects):
+                obj = self.wall_objects[row]
+            else:
+                obj = self.circle_objects[row - len(self.wall_objects)]
+            results.append((i, distance, obj, u, (x, y)))
+        return results
+
+    def get_tile_times(self):
+        return self.tile_times
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        for table in (self.walls, self.circles, self.candidates, self.circle_candidates, self.rays, self.hits):
+            table.close()
+        if self.published is not None:
+            self.published.remove_listener(self.on_world_change)
+            self.published = None
+
+
+class ThreadCaster:
+    """
+    Casts tiles of rays against the candidate walls on a thread pool, writing into shared
+    preallocated per-column result arrays
+    """
+
+    def __init__(self, workers=0, tile_size=64):
+        """
+        :param workers: number of threads, 0 uses every core
+        :param tile_size: number of columns cast by each task
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.tile_size = tile_size
+        self.executor = None
+
+        self.distances = np.zeros(0)
+        self.indices = np.zeros(0, dtype=np.int64)
+        self.us = np.zeros(0)
+        self.points = np.zeros((0, 2))
+
+        # (first column, end column, ms) for every tile in the last cast
+        self.tile_times = []
+
+    def start(self):
+        self.executor = concurrent.futures.ThreadPoolExecutor(self.workers)
+        atexit.register(self.close)
+
+    def resize(self, n):
+        if len(self.distances) != n:
+            self.distances = np.zeros(n)
+            self.indices = np.zeros(n, dtype=np.int64)
+            self.us = np.zeros(n)
+            self.points = np.zeros((n, 2))
+
+    def cast_tile(self, p1s, p2s, wall_p1, wall_p2, start, stop):
+        start_time = time.perf_counter()
+        points, distances, indices, us = geometry.intersect_rays_walls(
+            p1s[start:stop], p2s[start:stop], wall_p1, wall_p2)
+        self.distances[start:stop] = distances
+        self.indices[start:stop] = indices
+        self.us[start:stop] = us
+        self.points[start:stop] = points
+        return start, stop, (time.perf_counter() - start_time) * 1000
+
+    def cast(self, p1s, p2s, wall_p1, wall_p2):
+        """
+        Finds the closest wall hit by each ray
+        :param p1s: (n, 2) ray start points
+        :param p2s: (n, 2) ray end points
+        :param wall_p1: (m, 2) start points of the candidate walls
+        :param wall_p2: (m, 2) end points of the candidate walls
+        :return: (points, distances, wall indices, us) in the same form as geometry.intersect_rays_walls.
+        The arrays are reused by the next cast
+        """
+        if self.executor is None:
+            self.start()
+        n = len(p1s)
+        self.resize(n)
+        self.indices[:] = -1
+        self.distances[:] = np.inf
+        if len(wall_p1):
+            futures = [self.executor.submit(self.cast_tile, p1s, p2s, wall_p1, wall_p2, start, min(start + self.tile_size, n))
+                       for start in range(0, n, self.tile_size)]
+            self.tile_times = [future.result() for future in futures]
+        else:
+            self.tile_times = []
+        return self.points, self.distances, self.indices, self.us
+
+    def get_tile_times(self):
+        return self.tile_times
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
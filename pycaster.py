@@ -1,24 +1,81 @@
 from random import randint
 import configparser
 import math
+import os
 
+import numpy as np
 import pygame
 import support
 import geometry
+import mapio
+import parallel
+import spatial
+import streaming
+
+
+# Spans shown in the debug stats, in the order they nest: a frame contains an update, which contains
+# the cone update, broad phase and narrow phase, followed by generating and drawing the frame and the HUD
+TIMED_SPANS = ("frame", "stream", "update", "update_cone", "broad_phase", "check_collisions", "generate_frame", "draw", "hud")
+
+# Gap left between a moving circle and whatever it collides with
+COLLISION_SKIN = 1e-3
+
+# settings.ini is looked up next to this file so the engine works from any working directory
+SETTINGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'settings.ini')
 
 
 def rand_color():
     return randint(0, 255), randint(0, 255), randint(0, 255)
 
 
+def pack_color(color):
+    return (int(color[0]) << 16) | (int(color[1]) << 8) | int(color[2])
+
+
+def pack_colors(colors):
+    """
+    Packs an (n, 3) array of colors into an (n,) array of 0xRRGGBB values
+    """
+    colors = colors.astype(np.uint32)
+    return (colors[:, 0] << 16) | (colors[:, 1] << 8) | colors[:, 2]
+
+
+def unpack_color(color):
+    color = int(color)
+    return (color >> 16) & 255, (color >> 8) & 255, color & 255
+
+
 # TODO: Investigate the addition of a radial gradient to simulate a light source from the player location
 
 class Engine:
     def __init__(self, width, height, wall_height, current_position):
         # Get engine settings from settings.ini
+        config = configparser.ConfigParser()
+        config.read(SETTINGS_PATH)
+        en_config = config['ENGINE']
+
         self.width = width
         self.height = height
 
+        # How rays are tested against walls: batch, bvh, thread, process or reference
+        self.cast_mode = en_config.get('castMode', 'batch')
+        # Workers used by the thread and process cast modes, 0 uses every core. Pools are started on first use
+        self.cast_workers = en_config.getint('castWorkers', 0)
+        self.process_caster = None
+        self.thread_caster = parallel.ThreadCaster(self.cast_workers, en_config.getint('tileSize', 64))
+
+        # Streams chunks of a large map around the camera, set by stream_world
+        self.streamer = None
+        self.chunk_prefetch = en_config.getint('chunkPrefetch', 100)
+        self.chunk_memory = en_config.getint('chunkMemoryMB', 256) * 2 ** 20
+        self.chunk_merge_budget = en_config.getint('chunkMergeBudget', 250)
+
+        # Rolling window of every span's duration over the last statsWindow frames, for percentiles
+        self.frame_stats = support.RollingStats(en_config.getint('statsWindow', 600))
+
+        # Records timing spans for the debug stats and trace exports, the game adds its own spans to it
+        self.profiler = support.Profiler(stats=self.frame_stats)
+
         # Stores the state of all objects
         self.world_objects = WorldState()
 
@@ -26,6 +83,21 @@ class Engine:
         self.camera = Camera(current_position, wall_height, width, height)
 
         self.close_objects = self.world_objects.get_walls_in_range(self.camera.get_position(), self.camera.get_view_radius())
+        self.close_circles = self.world_objects.get_circles_in_range(self.camera.get_position(), self.camera.get_view_radius())
+
+        # Closest hit of each camera ray from the last update, shared by rendering and picking
+        self.hits = HitBuffer(self.camera.get_ray_count())
+        # Object under the reticle that was last marked selected
+        self.facing_object = None
+
+        # The world and (world geometry version, camera pose version) the hits were cast for. When
+        # neither has changed, the last cast is reused
+        self.cast_world = None
+        self.cast_key = None
+        # World version the frame was generated at, recolors only need a new frame and not a recast
+        self.frame_version = None
+        # Frame generated from the current hits, None until process_outputs needs it
+        self.frame = None
 
         self.debug_stats = {
             "value": {
@@ -33,109 +105,273 @@ class Engine:
                 "camera_ray_count": len(self.camera.get_camera_rays()),
                 "total_ray_count": self.camera.get_ray_count(),
                 "view_angle": round(self.camera.get_rotation_delta() * (180 / math.pi)),
-                "view_angle(rads)": self.camera.get_rotation_delta()
+                "view_angle(rads)": self.camera.get_rotation_delta(),
+                "cache_hits": 0,
+                "cache_misses": 0
             },
-            "time": {
-                "start": 0,
-                "cast_rays": 0,
-                "check_collisions": 0,
-                "end": 0
-            }
+            "time": {name: 0 for name in TIMED_SPANS}
         }
 
     # Calls all necessary updates for each cycle
     def update(self, dt):
-        timer = support.Timer()
-        self.debug_stats["time"]["start"] = timer.tick()
-        # Recast rays at current position
-        self.camera.update_cone()
-        self.debug_stats["time"]["cast_rays"] = timer.tick()
-        # Checks collisions with projected rays and walls
-        self.close_objects = self.world_objects.get_walls_in_range(self.camera.get_position(), self.camera.get_view_radius())
-        self.check_collisions(self.camera.get_camera_rays())
-        self.debug_stats["time"]["check_collisions"] = timer.tick()
-        self.debug_stats["time"]["end"] = timer.get_total_time()
+        if self.streamer is not None:
+            with self.profiler.span("stream"):
+                self.streamer.update(self.camera.get_position(), self.camera.get_view_radius())
+        if self.is_cast_current():
+            self.debug_stats["value"]["cache_hits"] += 1
+            return
+        self.debug_stats["value"]["cache_misses"] += 1
+        self.recast()
+
+    # True when neither the world nor the camera has changed since the last cast
+    def is_cast_current(self):
+        return self.cast_world is self.world_objects and \
+            self.cast_key == (self.world_objects.get_geometry_version(), self.camera.get_pose_version())
+
+    # Casts the camera's rays into the world, invalidating the cached frame
+    def recast(self):
+        self.cast_world = self.world_objects
+        self.cast_key = (self.world_objects.get_geometry_version(), self.camera.get_pose_version())
+        self.frame = None
+
+        with self.profiler.span("update"):
+            # Recast rays at current position
+            with self.profiler.span("update_cone"):
+                self.camera.update_cone()
+            # Broad phase, only walls and circles around the camera are tested against its rays. The
+            # bvh mode walks the world's wall BVH instead, so only circles are gathered for it
+            with self.profiler.span("broad_phase"):
+                if self.cast_mode == "bvh":
+                    self.close_objects = {}
+                else:
+                    self.close_objects = self.world_objects.get_walls_in_range(self.camera.get_position(),
+                                                                               self.camera.get_view_radius())
+                self.close_circles = self.world_objects.get_circles_in_range(self.camera.get_position(),
+                                                                             self.camera.get_view_radius())
+            # Checks collisions with projected rays and walls
+            with self.profiler.span("check_collisions"):
+                self.hits = self.cast_segments(self.camera.get_ray_starts(), self.camera.get_ray_ends(),
+                                               self.close_objects, self.close_circles)
+
+    def step(self, position, rotation_delta):
+        """
+        Moves the camera to a pose and renders it, without needing a display or input
+        :param position: new camera position
+        :param rotation_delta: new camera rotation in radians
+        :return: FrameState, which is reused by later frames
+        """
+        self.camera.set_position(position)
+        self.camera.set_rotation_delta(rotation_delta)
+        self.update(0)
+        return self.process_outputs()
 
     def process_outputs(self):
-        return self.camera.generate_frame()
+        # The world can change without an update, e.g. resetting the map from the pause menu
+        if not self.is_cast_current():
+            self.recast()
+        if self.frame is None or self.frame_version != self.world_objects.get_version():
+            with self.profiler.span("generate_frame"):
+                self.frame = self.camera.generate_frame(self.hits)
+            self.frame_version = self.world_objects.get_version()
+        return self.frame
+
+    def cast(self, origin, angle, max_dist):
+        """
+        Finds the closest wall or circle along a single ray
+        :param origin: start of the ray
+        :param angle: direction of the ray in radians
+        :param max_dist: length of the ray
+        :return: RayHit, or None if nothing was hit
+        """
+        return self.cast_batch(origin, [angle], max_dist).get_hit(0)
+
+    def cast_batch(self, origin, angles, max_dist):
+        """
+        Finds the closest wall or circle along a fan of rays sharing one origin
+        :param origin: start of every ray
+        :param angles: direction of each ray in radians
+        :param max_dist: length of every ray
+        :return: HitBuffer with one entry per angle
+        """
+        angles = np.asarray(angles, dtype=np.float64)
+        p1s = np.empty((len(angles), 2))
+        p1s[:] = origin
+        p2s = np.column_stack((origin[0] + max_dist * np.cos(angles), origin[1] + max_dist * np.sin(angles)))
+        return self.cast_segments(p1s, p2s, self.world_objects.get_walls_in_range(origin, max_dist),
+                                  self.world_objects.get_circles_in_range(origin, max_dist))
+
+    def cast_segments(self, p1s, p2s, walls, circles):
+        """
+        Finds the closest wall or circle hit by each ray, using the engine's cast mode for walls
+        :param p1s: (n, 2) ray start points
+        :param p2s: (n, 2) ray end points
+        :param walls: walls dictionary of candidate walls (ignored by the bvh mode)
+        :param circles: circles dictionary of candidate circles
+        :return: HitBuffer with one entry per ray
+        """
+        hits = HitBuffer(len(p1s), self.world_objects.get_wall_table())
+        if self.cast_mode == "process":
+            # Workers cast against circles as well
+            self.cast_process(p1s, p2s, walls, circles, hits)
+            return hits
+        if self.cast_mode == "bvh":
+            self.cast_walls_bvh(p1s, p2s, hits)
+        elif self.cast_mode == "thread":
+            self.cast_walls_thread(p1s, p2s, walls, hits)
+        elif self.cast_mode == "reference":
+            self.cast_walls_reference(p1s, p2s, walls, hits)
+        else:
+            self.cast_walls_batch(p1s, p2s, walls, hits)
+        self.cast_circles(p1s, p2s, circles, hits)
+        return hits
+
+    # Returns the object a screen column hit in the last cast, or None
+    def get_column_object(self, column):
+        if not self.is_cast_current():
+            self.recast()
+        if 0 <= column < len(self.hits):
+            return self.hits.objects[column]
+        return None
 
     # Sets the object we are currently looking at to be selected
     def set_facing_object(self):
-        center_ray = self.camera.get_center_ray()
-        walls = self.close_objects
-        circles = self.world_objects.get_circles()
-        for k in walls:
-            for w in walls[k]:
-                p2 = geometry.intersect(w, center_ray)
-                if p2 is not None:
-                    w.set_selected(True)
-                else:
-                    w.set_selected(False)
-        for k in circles:
-            for c in circles[k]:
-                p2 = geometry.circle_line_segment_intersection(c.get_p1(), c.get_r(),
-                                                               center_ray.get_p1(), center_ray.get_p2())
-                if p2 is not None:
-                    c.set_selected(True)
-                else:
-                    c.set_selected(False)
+        facing = self.get_facing_object()
+        if facing is self.facing_object:
+            return
+        if self.facing_object is not None:
+            self.facing_object.set_selected(False)
+        if facing is not None:
+            facing.set_selected(True)
+        self.facing_object = facing
 
     # Returns an instance of the wall currently being looked at
     def get_facing_object(self):
-        walls = self.close_objects
-        circles = self.world_objects.get_circles()
-        for k in walls:
-            for w in walls[k]:
-                if w.get_selected():
-                    return w
-        for k in circles:
-            for c in circles[k]:
-                if c.get_selected():
-                    return c
-        return None
+        return self.get_column_object(self.camera.get_center_column())
 
     # Deletes the wall we are currently looking at
     def remove_facing_object(self):
-        self.set_facing_object()
-        walls = self.close_objects
-        circles = self.world_objects.get_circles()
-        center_ray = self.camera.get_center_ray()
-        for k in walls:
-            for w in walls[k]:
-                if geometry.intersect(w, center_ray) is not None:
-                    self.world_objects.remove_wall(k, w)
-                    return
-        for k in circles:
-            for c in circles[k]:
-                if geometry.circle_line_segment_intersection(c.get_p1(), c.get_r(),
-                                                             center_ray.get_p1(), center_ray.get_p2()) is not None:
-                    self.world_objects.remove_circle(k, c)
-                    return
+        facing = self.get_facing_object()
+        if facing is not None:
+            self.world_objects.remove_object(facing)
+            if facing is self.facing_object:
+                self.facing_object = None
 
+    # Returns the start, end (hit point if any) and packed hit color of every camera ray
     def debug(self):
-        return self.camera.get_camera_rays()
+        ends = self.camera.get_ray_ends().copy()
+        colors = np.full(len(ends), pack_color((255, 255, 255)), dtype=np.uint32)
+        hit = np.flatnonzero(np.isfinite(self.hits.distances[:len(ends)]))
+        ends[hit] = self.hits.points[hit]
+        colors[hit] = pack_colors(self.hits.get_colors()[hit])
+        return self.camera.get_ray_starts(), ends, colors
 
     def get_debug_stats(self):
         self.debug_stats["value"]["total_obj_count"] = self.get_world_state().get_world_object_count()
+        for name in TIMED_SPANS:
+            self.debug_stats["time"][name] = self.profiler.get_last_ms(name)
         return self.debug_stats
 
+    def get_profiler(self):
+        return self.profiler
+
+    def get_frame_stats(self):
+        return self.frame_stats
+
     def process_mouse_movement(self, mouse_pos):
         self.camera.process_mouse_movement(mouse_pos)
 
     def process_keys(self):
-        return self.camera.process_keys(self.close_objects)
+        return self.camera.process_keys(self.world_objects)
 
     # Changes the color of the currently selected wall
     def color_wall(self, color):
         self.set_facing_object()
-        facing_wall = self.get_facing_object()
+        facing_wall = self.facing_object
         if facing_wall is not None:
-            facing_wall.set_color(color)
+            self.world_objects.set_object_color(facing_wall, color)
 
-    # Checks for collisions between a set of rays and all walls/circles
+    # Checks for collisions between a set of rays and all walls/circles, storing the hits and
+    # shortening each ray to its hit point
     def check_collisions(self, rays):
+        self.hits = self.cast_segments(np.array([ray.get_p1() for ray in rays], dtype=np.float64).reshape(-1, 2),
+                                       np.array([ray.get_p2() for ray in rays], dtype=np.float64).reshape(-1, 2),
+                                       self.close_objects, self.close_circles)
+        for i, ray in enumerate(rays):
+            obj = self.hits.objects[i]
+            if obj is not None:
+                ray.set_color(obj.get_color())
+                ray.set_p2((float(self.hits.points[i][0]), float(self.hits.points[i][1])))
+
+    # Solves every ray against every candidate wall in one batch
+    def cast_walls_batch(self, p1s, p2s, walls, hits):
+        walls = [w for k in walls for w in walls[k]]
+        if not walls:
+            return
+        table = self.world_objects.get_wall_table()
+        rows = table.get_rows(walls)
+        points, distances, indices, us = geometry.intersect_rays_walls(p1s, p2s, table.p1[rows], table.p2[rows])
+        columns = np.flatnonzero(indices >= 0)
+        hit = indices[columns]
+        hits.set_hits(columns, distances[columns], [walls[j] for j in hit.tolist()], us[columns], points[columns], rows[hit])
+
+    # Walks the world's wall BVH for each ray, which skips the broad phase entirely
+    def cast_walls_bvh(self, p1s, p2s, hits):
+        bvh = self.world_objects.get_wall_bvh()
+        for i in range(len(p1s)):
+            p1 = p1s[i]
+            p2 = p2s[i]
+            hit = bvh.closest_hit(p1, p2)
+            if hit is not None:
+                t, u, wall = hit
+                hits.set_hit(i, t * math.hypot(p2[0] - p1[0], p2[1] - p1[1]), wall, u, p1 + (p2 - p1) * t)
+
+    # Casts tiles of columns on a thread pool, and records each tile's time in the frame stats
+    def cast_walls_thread(self, p1s, p2s, walls, hits):
+        walls = [w for k in walls for w in walls[k]]
+        table = self.world_objects.get_wall_table()
+        rows = table.get_rows(walls)
+        points, distances, indices, us = self.thread_caster.cast(p1s, p2s, table.p1[rows], table.p2[rows])
+        for start, stop, ms in self.thread_caster.get_tile_times():
+            self.frame_stats.add("cast_tile", ms)
+        columns = np.flatnonzero(indices >= 0)
+        hit = indices[columns]
+        hits.set_hits(columns, distances[columns], [walls[j] for j in hit.tolist()], us[columns], points[columns], rows[hit])
+
+    # Splits the rays across a pool of worker processes reading shared copies of the world
+    def cast_process(self, p1s, p2s, walls, circles, hits):
+        if self.process_caster is None:
+            self.process_caster = parallel.ProcessCaster(self.cast_workers)
+        for i, distance, obj, u, point in self.process_caster.cast(self.world_objects, p1s, p2s, walls, circles):
+            hits.set_hit(i, distance, obj, u, point)
+
+    # Tests each ray against each candidate wall one at a time
+    def cast_walls_reference(self, p1s, p2s, walls, hits):
+        for i in range(len(p1s)):
+            ray = geometry.Line(tuple(p1s[i]), tuple(p2s[i]))
+            for k in walls:
+                for w in walls[k]:
+                    p = geometry.intersect(w, ray)
+                    if p is not None:
+                        d = geometry.dist(ray.get_p1(), p)
+                        if d < hits.distances[i]:
+                            hits.set_hit(i, d, w, geometry.dist(w.get_p1(), p) / geometry.length(w), p)
+
+    # Solves every ray against every candidate circle in one batch, keeping whichever of the
+    # circle and the wall already in hits is closer
+    def cast_circles(self, p1s, p2s, circles, hits):
+        circles = [c for k in circles for c in circles[k]]
+        if not circles:
+            return
+        centers = np.array([c.get_p1() for c in circles], dtype=np.float64)
+        radii = np.array([c.get_r() for c in circles], dtype=np.float64)
+        points, distances, indices, us = geometry.intersect_rays_circles(p1s, p2s, centers, radii)
+        columns = np.flatnonzero(distances < hits.distances)
+        hits.set_hits(columns, distances[columns], [circles[j] for j in indices[columns].tolist()], us[columns], points[columns])
+
+    # Per-object version of check_collisions, kept as a reference for checking the batched results
+    def check_collisions_reference(self, rays):
         walls = self.close_objects
-        circles = self.world_objects.get_circles()
+        circles = self.close_circles
         for ray in rays:
             for k in walls:
                 for w in walls[k]:
@@ -153,6 +389,20 @@ class Engine:
     def set_world_objects(self, world_objects):
         self.world_objects = world_objects
 
+    def stream_world(self, directory):
+        """
+        Replaces the world with one that streams in the chunks around the camera
+        :param directory: chunk directory written by streaming.build_chunks
+        """
+        if self.streamer is not None:
+            self.streamer.close()
+        self.world_objects = WorldState()
+        self.streamer = streaming.ChunkStreamer(self.world_objects, directory, self.chunk_prefetch,
+                                                self.chunk_memory, self.chunk_merge_budget)
+
+    def get_streamer(self):
+        return self.streamer
+
     def get_world_state(self):
         return self.world_objects
 
@@ -163,51 +413,127 @@ class Engine:
         return self.camera.get_position()
 
 
-# A segment represents a vertical slice of the final rendered image
-class Segment:
-    def __init__(self, color, p1, p2):
-        self.color = color
-        self.p1 = p1
-        self.p2 = p2
+# The closest object a single ray hit
+class RayHit:
+    def __init__(self, distance, obj, u, point):
+        # Distance from the ray's origin to the hit point
+        self.distance = distance
+        # The wall or circle that was hit
+        self.obj = obj
+        # Position along the wall (0 - 1), or the angle around the circle (0 - 1)
+        self.u = u
+        self.point = point
 
-    def get_color(self):
-        return self.color
+    def get_distance(self):
+        return self.distance
 
-    def set_color(self, color):
-        self.color = color
+    def get_object(self):
+        return self.obj
 
-    def get_p1(self):
-        return self.p1
+    def get_u(self):
+        return self.u
 
-    def set_p1(self, p1):
-        self.p1 = p1
+    def get_point(self):
+        return self.point
 
-    def get_p2(self):
-        return self.p2
 
-    def set_p2(self, p2):
-        self.p2 = p2
+# Stores the closest hit of each ray in a batch column-wise, rays that hit nothing have an
+# infinite distance and no object
+class HitBuffer:
+    def __init__(self, size, table=None):
+        """
+        :param size: number of rays
+        :param table: WallTable the hit walls live in, so their colors can be read straight from it
+        """
+        self.distances = np.full(size, np.inf)
+        self.us = np.zeros(size)
+        self.points = np.zeros((size, 2))
+        self.objects = [None] * size
+        # Wall table row of each hit wall, -1 for circles and misses
+        self.rows = np.full(size, -1, dtype=np.intp)
+        self.table = table
+
+    def set_hit(self, i, distance, obj, u, point, row=None):
+        self.distances[i] = distance
+        self.objects[i] = obj
+        self.us[i] = u
+        self.points[i] = point
+        if row is None:
+            row = obj.row if isinstance(obj, geometry.WallView) and obj.table is self.table else -1
+        self.rows[i] = row
+
+    # Stores the hits of many rays at once
+    def set_hits(self, columns, distances, objects, us, points, rows=-1):
+        self.distances[columns] = distances
+        self.us[columns] = us
+        self.points[columns] = points
+        self.rows[columns] = rows
+        for i, obj in zip(columns.tolist(), objects):
+            self.objects[i] = obj
+
+    def get_colors(self):
+        """
+        Looks up the current color of whatever each ray hit. Walls are gathered from the wall table in
+        one go, so only circle hits go through their objects
+        :return: (n, 3) array of colors, white where nothing was hit
+        """
+        colors = np.full((len(self.rows), 3), 255.0)
+        walls = self.rows >= 0
+        if self.table is not None:
+            colors[walls] = self.table.colors[self.rows[walls]]
+        for i in np.flatnonzero(~walls & np.isfinite(self.distances)).tolist():
+            colors[i] = self.objects[i].get_color()
+        return colors
+
+    def get_hit(self, i):
+        if self.objects[i] is None:
+            return None
+        return RayHit(float(self.distances[i]), self.objects[i], float(self.us[i]),
+                      (float(self.points[i][0]), float(self.points[i][1])))
+
+    def get_distances(self):
+        return self.distances
+
+    def get_objects(self):
+        return self.objects
+
+    def __len__(self):
+        return len(self.objects)
 
 
-# Stores the state of each frame generated from the pycaster engine
+# Stores the state of each frame generated from the pycaster engine. Each column of the frame is a
+# vertical slice of the final rendered image, stored column-wise in arrays that are reused every frame
 class FrameState:
-    def __init__(self):
-        # A list of segments which make up each individual vertical line to be displayed on the screen
-        self.segments = []
+    def __init__(self, column_count, width):
+        # Screen y of the top and bottom of each column's slice
+        self.tops = np.zeros(column_count)
+        self.bottoms = np.zeros(column_count)
+        # Shaded color of each column packed as 0xRRGGBB
+        self.colors = np.zeros(column_count, dtype=np.uint32)
+        # Distance from the camera to whatever each column hit
+        self.depths = np.zeros(column_count)
+        # Screen x of each column
+        self.xs = np.arange(column_count) * (width / column_count)
         # The width of each segment
-        self.segment_width = 0
+        self.segment_width = int(width / column_count + 1)
 
-    def get_segments(self):
-        return self.segments
+    def get_tops(self):
+        return self.tops
 
-    def set_segments(self, segments):
-        self.segments = segments
+    def get_bottoms(self):
+        return self.bottoms
 
-    def add_segment(self, segment):
-        self.segments.append(segment)
+    def get_colors(self):
+        return self.colors
 
-    def clear_segments(self):
-        self.segments.clear()
+    def get_depths(self):
+        return self.depths
+
+    def get_xs(self):
+        return self.xs
+
+    def get_column_count(self):
+        return len(self.xs)
 
     def get_segment_width(self):
         return self.segment_width
@@ -217,39 +543,231 @@ class FrameState:
 
 
 class WorldState:
-    def __init__(self):
+    """
+    Holds every wall and circle in groups, and keeps the data derived from them (object counts,
+    group bounding boxes, the spatial index and BVH) up to date as each edit happens, so an edit
+    only costs as much as the objects it touches. Listeners added with add_listener are called
+    after every change with (event, kind, key, objects), where event is add, remove, move, recolor
+    or replace, kind is wall or circle and objects is the list of changed objects (None for replace).
+    """
+
+    def __init__(self, cell_size=50):
         self.walls = {}
         self.circles = {}
 
+        # Geometry of every wall. The group lists hold WallViews into it, so walls passed to the
+        # mutators below are copied in rather than stored
+        self.wall_table = geometry.WallTable()
+        self.wall_table.owner = self
+
+        # Broad-phase index of every wall, kept in sync by the wall mutators below
+        self.wall_index = spatial.SpatialHash(cell_size)
+        # Wall -> group key, used to rebuild group dicts from index queries
+        self.wall_groups = {}
+        # Ray query tree over every wall, updated in place and only rebuilt once it has drifted too far
+        self.wall_bvh = None
+
+        # Broad-phase index of every circle by its bounding box, kept in sync by the circle mutators below
+        self.circle_index = spatial.SpatialHash(cell_size)
+        # Circle -> group key
+        self.circle_groups = {}
+
+        self.wall_count = 0
+        self.circle_count = 0
+        # Group key -> [min x, min y, max x, max y] of its walls and circles. Removing an object on the
+        # edge of a box marks the group dirty, and the box is recomputed the next time it is asked for
+        self.group_bounds = {}
+        self.dirty_groups = set()
+
+        self.listeners = []
+
+        # Bumped by every mutation, so consumers can tell whether anything changed since they last looked
+        self.version = 0
+        # Only bumped by mutations that move, add or remove objects, recoloring leaves it alone
+        self.geometry_version = 0
+
     def load_state(self, filename):
-        with open(filename, 'r') as file:
-            self.walls.clear()
-            self.circles.clear()
-            for line in file:
-                line_split = line.split(':')
-                key = line_split[0]
-                vals = line_split[1].split('; ')
-                if key in self.walls:
-                    self.walls[key].append(geometry.Wall(eval(vals[0]), eval(vals[1]), eval(vals[2])))
-                else:
-                    self.walls[key] = [geometry.Wall(eval(vals[0]), eval(vals[1]), eval(vals[2]))]
+        if mapio.is_binary_map(filename):
+            self.load_binary_state(filename)
+            return
+        self.load_map_file(mapio.MapFile(*mapio.read_text_arrays(filename)))
+
+    def get_version(self):
+        return self.version
+
+    def get_geometry_version(self):
+        return self.geometry_version
+
+    def mark_changed(self):
+        self.version += 1
+
+    def add_listener(self, listener):
+        """
+        :param listener: called as listener(event, kind, key, objects) after every change
+        """
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    def notify(self, event, kind, key, objects):
+        self.mark_changed()
+        if event != "recolor":
+            self.geometry_version += 1
+        for listener in self.listeners:
+            listener(event, kind, key, objects)
+
+    def set_object_color(self, obj, color):
+        """
+        Recolors a wall or circle in the world
+        :param obj: wall or circle
+        :param color: new color
+        """
+        if isinstance(obj, geometry.WallView) and obj.table is self.wall_table:
+            self.wall_table.colors[obj.row] = color
+        else:
+            obj.set_color(color)
+        self.notify("recolor", "circle" if isinstance(obj, geometry.Circle) else "wall", None, [obj])
+
+    def set_wall_endpoints(self, wall, p1, p2):
+        """
+        Moves a wall, keeping the indexes and group bounds up to date
+        :param wall: wall in the world
+        :param p1: new start point
+        :param p2: new end point
+        """
+        key = self.wall_groups[wall]
+        self.unindex_wall(wall)
+        self.shrink_bounds(key, [wall])
+        self.wall_table.set_endpoints(wall.row, p1, p2)
+        self.index_wall(key, wall)
+        self.grow_bounds(key, [wall])
+        self.notify("move", "wall", key, [wall])
+
+    def reset_wall_table(self):
+        # Views of the old walls keep the old table alive, but their changes no longer reach this world
+        self.wall_table.owner = None
+        self.wall_table = geometry.WallTable()
+        self.wall_table.owner = self
+
+    def load_binary_state(self, filename):
+        """
+        Replaces every wall and circle with the contents of a binary map
+        :param filename: map in the mapio format
+        """
+        self.load_map_file(mapio.load_map(filename))
+
+    def load_map_file(self, map_file):
+        """
+        Replaces every wall and circle with the contents of a map
+        :param map_file: mapio.MapFile
+        """
+        self.remove_all_walls()
+        self.remove_all_circles()
+        for key, walls in map_file.get_group_walls().items():
+            self.add_wall_arrays(key, walls["p1"], walls["p2"], walls["color"])
+        for key, circles in map_file.get_group_circles().items():
+            self.add_circles(key, [geometry.Circle(tuple(center), r, tuple(color)) for center, r, color in
+                                   zip(circles["center"].tolist(), circles["r"].tolist(), circles["color"].tolist())])
+
+    def save_binary_state(self, filename):
+        """
+        Writes every wall and circle as a binary map
+        :param filename: map in the mapio format
+        """
+        group_names = []
+        walls = mapio.make_walls(self.walls, group_names)
+        circles = mapio.make_circles(self.circles, group_names)
+        mapio.save_map(filename, group_names, walls, circles)
 
     def save_state(self, filename):
+        if filename.endswith(mapio.EXTENSION):
+            self.save_binary_state(filename)
+            return
         print("saving!")
-        with open(filename, 'w') as file:
-            data = ""
+        with mapio.TextMapWriter(filename) as writer:
             for k in self.walls:
                 for w in self.walls[k]:
-                    data += "{0}: {1}; {2}; {3}\n".format(k, w.get_p1(), w.get_p2(), w.get_color())
-            # Remove trailing newline
-            data = data[0:len(data) - 1]
-            file.write(data)
+                    writer.write_wall(k, w.get_p1(), w.get_p2(), w.get_color())
+            for k in self.circles:
+                for c in self.circles[k]:
+                    writer.write_circle(k, c.get_p1(), c.get_r(), c.get_color())
+
+    def get_object_bounds(self, obj):
+        """
+        :param obj: wall or circle
+        :return: (min x, min y, max x, max y) of the object
+        """
+        if isinstance(obj, geometry.Circle):
+            (x, y), r = obj.get_p1(), obj.get_r()
+            return x - r, y - r, x + r, y + r
+        if isinstance(obj, geometry.WallView):
+            return obj.get_bounds()
+        (x1, y1), (x2, y2) = obj.get_p1(), obj.get_p2()
+        return min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)
+
+    def grow_bounds(self, key, objects):
+        for obj in objects:
+            self.grow_bounds_box(key, self.get_object_bounds(obj))
+
+    def grow_bounds_box(self, key, box):
+        """
+        Extends a group's bounding box to cover a box
+        :param box: (min x, min y, max x, max y)
+        """
+        if key in self.dirty_groups:
+            return
+        bounds = self.group_bounds.get(key)
+        if bounds is None:
+            self.group_bounds[key] = list(box)
+            return
+        bounds[0] = min(bounds[0], box[0])
+        bounds[1] = min(bounds[1], box[1])
+        bounds[2] = max(bounds[2], box[2])
+        bounds[3] = max(bounds[3], box[3])
+
+    def shrink_bounds(self, key, objects):
+        bounds = self.group_bounds.get(key)
+        if bounds is None or key in self.dirty_groups:
+            return
+        for obj in objects:
+            lo_x, lo_y, hi_x, hi_y = self.get_object_bounds(obj)
+            # Objects strictly inside the box can't have been holding it open
+            if lo_x <= bounds[0] or lo_y <= bounds[1] or hi_x >= bounds[2] or hi_y >= bounds[3]:
+                self.dirty_groups.add(key)
+                return
+
+    def get_group_bounds(self, key):
+        """
+        :param key: wall and circle group
+        :return: ((min x, min y), (max x, max y)) of every wall and circle in the group, or None if it is empty
+        """
+        if key in self.dirty_groups:
+            self.dirty_groups.discard(key)
+            self.group_bounds.pop(key, None)
+            self.grow_bounds(key, self.walls.get(key, []))
+            self.grow_bounds(key, self.circles.get(key, []))
+        bounds = self.group_bounds.get(key)
+        if bounds is None:
+            return None
+        return (bounds[0], bounds[1]), (bounds[2], bounds[3])
 
     def get_circles(self):
         return self.circles
 
     def set_circles(self, circles):
+        for key in self.circles:
+            self.dirty_groups.add(key)
+        self.circle_index.clear()
+        self.circle_groups.clear()
         self.circles = circles
+        self.circle_count = 0
+        for key in self.circles:
+            self.circle_count += len(self.circles[key])
+            self.dirty_groups.add(key)
+            for circle in self.circles[key]:
+                self.index_circle(key, circle)
+        self.notify("replace", "circle", None, None)
 
     def add_circles(self, key, circles):
         if key in self.circles:
@@ -259,22 +777,105 @@ class WorldState:
             self.circles[key] = temp
         else:
             self.circles[key] = circles
+        for circle in circles:
+            self.index_circle(key, circle)
+        self.circle_count += len(circles)
+        self.grow_bounds(key, circles)
+        self.notify("add", "circle", key, circles)
 
     def remove_circle(self, key, circle):
         self.circles[key].remove(circle)
+        self.unindex_circle(circle)
+        self.circle_count -= 1
+        self.shrink_bounds(key, [circle])
+        self.notify("remove", "circle", key, [circle])
 
     def change_circles(self, key, circles):
+        old = self.circles.get(key, [])
+        for circle in old:
+            self.unindex_circle(circle)
         self.circles[key] = circles
+        for circle in circles:
+            self.index_circle(key, circle)
+        self.circle_count += len(circles) - len(old)
+        self.shrink_bounds(key, old)
+        self.grow_bounds(key, circles)
+        self.notify("remove", "circle", key, old)
+        self.notify("add", "circle", key, circles)
 
     def remove_circle_group(self, key):
-        self.circles.pop(key)
+        circles = self.circles.pop(key)
+        for circle in circles:
+            self.unindex_circle(circle)
+        self.circle_count -= len(circles)
+        self.shrink_bounds(key, circles)
+        self.notify("remove", "circle", key, circles)
+
+    def pop_circles(self, key, count):
+        """
+        Removes the last circles of a group, and the group itself once it is empty
+        :param key: circle group
+        :param count: maximum number of circles to remove
+        :return: number of circles removed
+        """
+        group = self.circles[key]
+        circles = group[-count:] if count < len(group) else group
+        if circles is group:
+            del self.circles[key]
+        else:
+            del group[-count:]
+        for circle in circles:
+            self.unindex_circle(circle)
+        self.circle_count -= len(circles)
+        self.shrink_bounds(key, circles)
+        self.notify("remove", "circle", key, circles)
+        return len(circles)
 
     def remove_all_circles(self):
+        for key in self.circles:
+            self.dirty_groups.add(key)
         self.circles.clear()
+        self.circle_index.clear()
+        self.circle_groups.clear()
+        self.circle_count = 0
+        self.notify("replace", "circle", None, None)
+
+    def index_circle(self, key, circle):
+        self.circle_index.insert_circle(circle, circle.get_p1(), circle.get_r())
+        self.circle_groups[circle] = key
+
+    def unindex_circle(self, circle):
+        self.circle_index.remove(circle)
+        self.circle_groups.pop(circle, None)
+
+    def remove_object(self, obj):
+        """
+        Removes a wall or circle from whichever group holds it
+        :param obj: wall or circle in the world
+        """
+        if obj in self.circle_groups:
+            self.remove_circle(self.circle_groups[obj], obj)
+        elif obj in self.wall_groups:
+            self.remove_wall(self.wall_groups[obj], obj)
+
+    def get_circles_in_range(self, c, r):
+        """
+        Used in broad-phase collision detection, only returns circles that overlap the box around a point
+        :param c: center of the point
+        :param r: radius out from that point
+        :return: circles dictionary containing collidable circles
+        """
+        c_circles = {k: [] for k in self.circles}
+        for circle in self.circle_index.query_box((c[0] - r, c[1] - r), (c[0] + r, c[1] + r)):
+            c_circles[self.circle_groups[circle]].append(circle)
+        return c_circles
 
     def get_all_walls(self):
         return self.walls
 
+    def get_wall_table(self):
+        return self.wall_table
+
     def get_walls_in_range(self, c, r):
         """
         Used in broad-phase collision detection, only returns walls that are from a certain distance of a point
@@ -282,25 +883,94 @@ class WorldState:
         :param r: radius out from that point
         :return: walls dictionary containing collidable walls
         """
-        c_walls = {}
-        for k in self.walls:
-            temp = []
-            for wall in self.walls[k]:
-                p1 = wall.get_p1()
-                p2 = wall.get_p2()
-                if c[0] - r < p1[0] < c[0] + r and c[1] - r < p1[1] < c[1] + r:
-                    temp.append(wall)
-                elif c[0] - r < p2[0] < c[0] + r and c[1] - r < p2[1] < c[1] + r:
-                    temp.append(wall)
-            c_walls[k] = temp
+        c_walls = {k: [] for k in self.walls}
+        for wall in self.wall_index.query_box((c[0] - r, c[1] - r), (c[0] + r, c[1] + r)):
+            c_walls[self.wall_groups[wall]].append(wall)
         return c_walls
 
+    def slide_circle(self, p1, p2, radius, iterations=3):
+        """
+        Moves a circle, such as the player, from p1 towards p2, stopping at the nearest wall or circle
+        in the way and sliding the rest of the movement along it. Only walls and circles near the
+        movement are tested
+        :param p1: current position
+        :param p2: wanted position
+        :param radius: radius of the moving circle
+        :param iterations: maximum number of contacts slid along per movement
+        :return: position the circle ends up at
+        """
+        x, y = p1
+        dx, dy = p2[0] - x, p2[1] - y
+        for _ in range(iterations):
+            move_length = math.hypot(dx, dy)
+            if move_length == 0:
+                break
+            lo = (min(x, x + dx) - radius, min(y, y + dy) - radius)
+            hi = (max(x, x + dx) + radius, max(y, y + dy) + radius)
+            rows = self.wall_table.get_rows(self.wall_index.query_box(lo, hi))
+            circles = self.circle_index.query_box(lo, hi)
+            contact = geometry.sweep_circle((x, y), (x + dx, y + dy), radius, self.wall_table.p1[rows],
+                                            self.wall_table.p2[rows], [c.get_p1() for c in circles],
+                                            [c.get_r() for c in circles])
+            if contact is None:
+                return x + dx, y + dy
+            t, (nx, ny) = contact
+            # Stop just short of the contact so the next sweep doesn't start touching it
+            t = max(0.0, t - COLLISION_SKIN / move_length)
+            x += dx * t
+            y += dy * t
+            # Slide: keep only the part of the remaining movement along the obstacle
+            dx *= 1 - t
+            dy *= 1 - t
+            into = dx * nx + dy * ny
+            dx -= into * nx
+            dy -= into * ny
+        return x, y
+
+    def get_wall_bvh(self):
+        """
+        Returns the BVH over every wall, rebuilding it if it hasn't been built yet or too many walls
+        have been added or removed since it was
+        :return: spatial.BVH
+        """
+        if self.wall_bvh is None or self.wall_bvh.needs_rebuild():
+            table = self.wall_table
+            rows = table.get_active_rows()
+            self.wall_bvh = spatial.BVH()
+            self.wall_bvh.build(zip([table.views[row] for row in rows.tolist()], table.p1[rows].tolist(), table.p2[rows].tolist()))
+        return self.wall_bvh
+
+    def index_wall(self, key, wall):
+        self.wall_index.insert_segment(wall, wall.get_p1(), wall.get_p2())
+        self.wall_groups[wall] = key
+        if self.wall_bvh is not None:
+            self.wall_bvh.insert(wall, wall.get_p1(), wall.get_p2())
+
+    def unindex_wall(self, wall):
+        self.wall_index.remove(wall)
+        self.wall_groups.pop(wall, None)
+        if self.wall_bvh is not None:
+            self.wall_bvh.remove(wall)
+
     def set_walls(self, walls):
         """
         Sets the walls dict to a new walls dict
         :param walls: new walls dict
         """
-        self.walls = walls
+        for key in self.walls:
+            self.dirty_groups.add(key)
+        self.wall_index.clear()
+        self.wall_groups.clear()
+        self.wall_bvh = None
+        self.reset_wall_table()
+        self.walls = {k: [self.wall_table.add_wall(w) for w in walls[k]] for k in walls}
+        self.wall_count = 0
+        for k in self.walls:
+            self.wall_count += len(self.walls[k])
+            self.dirty_groups.add(k)
+            for wall in self.walls[k]:
+                self.index_wall(k, wall)
+        self.notify("replace", "wall", None, None)
 
     def add_walls(self, key, walls):
         """
@@ -309,6 +979,7 @@ class WorldState:
         :param key: wall group
         :param walls: set of walls to add to the group
         """
+        walls = [self.wall_table.add_wall(wall) for wall in walls]
         if key in self.walls:
             temp = self.walls[key]
             for wall in walls:
@@ -316,6 +987,33 @@ class WorldState:
             self.walls[key] = temp
         else:
             self.walls[key] = walls
+        for wall in walls:
+            self.index_wall(key, wall)
+        self.wall_count += len(walls)
+        self.grow_bounds(key, walls)
+        self.notify("add", "wall", key, walls)
+
+    def add_wall_arrays(self, key, p1s, p2s, colors):
+        """
+        Adds walls to a group straight from arrays, without making Wall objects first
+        :param key: wall group
+        :param p1s: (n, 2) start points
+        :param p2s: (n, 2) end points
+        :param colors: (n, 3) colors
+        """
+        walls = self.wall_table.add_many(p1s, p2s, colors)
+        self.walls.setdefault(key, []).extend(walls)
+        # Same as index_wall, without going back through the views for the endpoints
+        for wall, p1, p2 in zip(walls, np.asarray(p1s).tolist(), np.asarray(p2s).tolist()):
+            self.wall_index.insert_segment(wall, p1, p2)
+            self.wall_groups[wall] = key
+            if self.wall_bvh is not None:
+                self.wall_bvh.insert(wall, p1, p2)
+        self.wall_count += len(walls)
+        if walls:
+            points = np.concatenate((p1s, p2s))
+            self.grow_bounds_box(key, points.min(axis=0).tolist() + points.max(axis=0).tolist())
+        self.notify("add", "wall", key, walls)
 
     def remove_wall(self, key, wall):
         """
@@ -324,41 +1022,88 @@ class WorldState:
         :param wall: specific wall being removed
         """
         self.walls[key].remove(wall)
+        self.unindex_wall(wall)
+        self.wall_table.remove(wall)
+        self.wall_count -= 1
+        self.shrink_bounds(key, [wall])
+        self.notify("remove", "wall", key, [wall])
 
     def change_walls(self, key, walls):
         """
         Updates a list of walls in the dict
         WILL REPLACE THE WALLS
         """
+        old = self.walls.get(key, [])
+        for wall in old:
+            self.unindex_wall(wall)
+            self.wall_table.remove(wall)
+        walls = [self.wall_table.add_wall(wall) for wall in walls]
         self.walls[key] = walls
+        for wall in walls:
+            self.index_wall(key, wall)
+        self.wall_count += len(walls) - len(old)
+        self.shrink_bounds(key, old)
+        self.grow_bounds(key, walls)
+        self.notify("remove", "wall", key, old)
+        self.notify("add", "wall", key, walls)
 
     def remove_wall_group(self, key):
         """
         Removes a group of walls
         :param key: wall group
         """
-        self.walls.pop(key)
+        walls = self.walls.pop(key)
+        for wall in walls:
+            self.unindex_wall(wall)
+            self.wall_table.remove(wall)
+        self.wall_count -= len(walls)
+        self.shrink_bounds(key, walls)
+        self.notify("remove", "wall", key, walls)
+
+    def pop_walls(self, key, count):
+        """
+        Removes the last walls of a group, and the group itself once it is empty
+        :param key: wall group
+        :param count: maximum number of walls to remove
+        :return: number of walls removed
+        """
+        group = self.walls[key]
+        walls = group[-count:] if count < len(group) else group
+        if walls is group:
+            del self.walls[key]
+        else:
+            del group[-count:]
+        for wall in walls:
+            self.unindex_wall(wall)
+            self.wall_table.remove(wall)
+        self.wall_count -= len(walls)
+        self.shrink_bounds(key, walls)
+        self.notify("remove", "wall", key, walls)
+        return len(walls)
 
     def remove_all_walls(self):
         """
         Clears the entire walls dict
         """
+        for key in self.walls:
+            self.dirty_groups.add(key)
         self.walls.clear()
+        self.wall_index.clear()
+        self.wall_groups.clear()
+        self.wall_bvh = None
+        self.reset_wall_table()
+        self.wall_count = 0
+        self.notify("replace", "wall", None, None)
 
     def get_world_object_count(self):
-        s = 0
-        for k in self.walls:
-            s += len(self.walls[k])
-        for k in self.circles:
-            s += len(self.circles[k])
-        return s
+        return self.wall_count + self.circle_count
 
 
 class Camera:
     def __init__(self, position, wall_height, width, height):
         # initialize the config parsers
         config = configparser.ConfigParser()
-        config.read('settings.ini')
+        config.read(SETTINGS_PATH)
         en_config = config['ENGINE']
         mo_config = config['MOVEMENT']
 
@@ -388,6 +1133,9 @@ class Camera:
         # Pixels the camera moves
         self.movement_units = float(mo_config['movementUnits'])
 
+        # Radius of the player's collision circle, 0 turns player collision off
+        self.player_radius = mo_config.getfloat('playerRadius', 5)
+
         # Sprint scalar applied when holding shift
         self.sprint_scalar = float(mo_config['sprintScalar'])
 
@@ -411,6 +1159,9 @@ class Camera:
         # Current position
         self.position = position
 
+        # Bumped whenever the position, rotation or projection settings change
+        self.pose_version = 0
+
         # List of all rays cast from the camera
         self.all_rays = []
 
@@ -442,9 +1193,89 @@ class Camera:
         p2 = self.cast_ray(p1, angle, self.view_radius)
         self.fov_center_ray = geometry.Ray(p1, p2, (255, 255, 255), 0)
 
+        # Per-column lookup tables, only rebuilt when fov, ray_count or camera_plane_distance change
+        self.build_column_tables()
+
+        # Entries per world unit in the depth shading table
+        self.shade_table_resolution = 4
+
+        # Depth shading lookup table, only rebuilt when lighting_distance, fog_color or view_radius change
+        self.build_shade_table()
+
         # Update the fov cone
         self.gen_cone()
 
+    def build_column_tables(self):
+        """
+        Precomputes everything about each column that doesn't depend on the camera's pose,
+        and preallocates the per-frame ray arrays
+        """
+        n = self.ray_count
+        # Length of the camera plane between the two outermost rays
+        camera_plane_length = 2 * self.camera_plane_distance * math.sin(self.fov / 2)
+        # Theta = angle from the fov center ray that intersects the camera plane at an even interval
+        # We use theta because without, we get a very odd distortion
+        self.column_angles = np.arctan((camera_plane_length / n) * (np.arange(n) - (n - 1) / 2) / self.camera_plane_distance)
+        # Fisheye correction, the perpendicular distance to a wall is ray_length * cos(theta)
+        self.column_cos = np.cos(self.column_angles)
+        # Projected slice height = column_scale / ray_length
+        self.column_scales = self.wall_height * self.camera_plane_distance / self.column_cos
+        # Unit direction of each column's ray when the camera has no rotation
+        self.column_dirs = np.column_stack((np.cos(self.column_angles), np.sin(self.column_angles)))
+
+        # Per-frame ray arrays, overwritten in place by update_cone
+        self.ray_angles = np.empty(n)
+        self.ray_dirs = np.empty((n, 2))
+        self.ray_starts = np.empty((n, 2))
+        self.ray_ends = np.empty((n, 2))
+        self.update_cone()
+        self.pose_version += 1
+
+        # Reused by every call to generate_frame
+        self.frame = FrameState(n, self.width)
+
+    def build_shade_table(self):
+        """
+        Precomputes the logarithmic light falloff for every quantized distance up to the view radius.
+        A color at distance d is shaded to max(fog, color * shade_keep[d] + shade_fog[d])
+        """
+        distances = np.arange(int(self.view_radius * self.shade_table_resolution) + 2) / self.shade_table_resolution
+        falloff = np.log(distances + 1) / math.log(self.lighting_distance + 1)
+        self.shade_keep = 1 - falloff
+        self.shade_fog = falloff[:, None] * np.array(self.fog_color, dtype=np.float64)
+        self.pose_version += 1
+
+    def set_lighting_distance(self, lighting_distance):
+        self.lighting_distance = lighting_distance
+        self.build_shade_table()
+
+    def set_fog_color(self, fog_color):
+        self.fog_color = fog_color
+        self.build_shade_table()
+
+    def set_view_radius(self, view_radius):
+        self.view_radius = view_radius
+        self.build_shade_table()
+        self.update_cone()
+
+    def set_fov(self, fov):
+        """
+        :param fov: field of view in radians
+        """
+        self.fov = fov
+        self.set_resolution_scale(self.resolution_scale)
+
+    def set_resolution_scale(self, resolution_scale):
+        self.resolution_scale = resolution_scale
+        self.ray_count = int((self.width / (self.fov / (360 * (math.pi / 180)))) / self.resolution_scale)
+        self.build_column_tables()
+        self.cone_rays = []
+        self.gen_cone()
+
+    def set_camera_plane_distance(self, camera_plane_distance):
+        self.camera_plane_distance = camera_plane_distance
+        self.build_column_tables()
+
     def cast_ray(self, origin, angle, distance):
         x = origin[0] + distance * math.cos(angle)
         y = origin[1] + distance * math.sin(angle)
@@ -457,68 +1288,53 @@ class Camera:
             p2 = self.cast_ray(p1, angle, self.view_radius)
             self.cone_rays.append(geometry.Ray(p1, p2, (255, 255, 255), angle))
 
-    # Updates what rays are included in our FoV cone
+    # Updates what rays are included in our FoV cone by rotating the precomputed column directions
     def update_cone(self):
-        camera_plane_p1 = self.cast_ray(self.position, self.rotation_delta - self.fov / 2, self.camera_plane_distance)
-        camera_plane_p2_angle = self.rotation_delta - self.fov / 2 + (self.ray_count - 1) * (self.fov / (self.ray_count - 1))
-        camera_plane_p2 = self.cast_ray(self.position, camera_plane_p2_angle, self.camera_plane_distance)
-
-        camera_plane_length = geometry.length(geometry.Line(camera_plane_p1, camera_plane_p2))
-        p1 = self.position
-        for i in range(self.ray_count):
-            # Theta = angle from the fov center ray that intersects the camera plane at an even interval
-            theta = math.atan(((camera_plane_length / self.ray_count) * (i - ((self.ray_count - 1) / 2))) / self.camera_plane_distance)
-            # We use theta because without, we get a very odd distortion
-            # angle = self.rotation_delta - self.fov / 2 + i * (self.fov / (self.ray_count - 1))
-            angle = self.rotation_delta + theta
-            p2 = self.cast_ray(p1, angle, self.view_radius)
-
-            self.cone_rays[i].set_p1(p1)
-            self.cone_rays[i].set_p2(p2)
-            self.cone_rays[i].set_rd(angle)
+        np.add(self.column_angles, self.rotation_delta, out=self.ray_angles)
+        cos_r = math.cos(self.rotation_delta)
+        sin_r = math.sin(self.rotation_delta)
+        np.dot(self.column_dirs, np.array(((cos_r, sin_r), (-sin_r, cos_r))), out=self.ray_dirs)
+        self.ray_starts[:] = self.position
+        np.multiply(self.ray_dirs, self.view_radius, out=self.ray_ends)
+        self.ray_ends += self.ray_starts
 
     # Returns FrameState object, which contains all information about the
-    def generate_frame(self):
-        rays = self.cone_rays.copy()
-
-        # Padding between each slice
-        padding = self.width / len(rays)
-
-        # Initialize the frame
-        frame = FrameState()
-        frame.set_segment_width(int(padding + 1))
-        segment_count = 0
-
-        # Draw walls
-        for ray in self.cone_rays:
-            # Help with the math: https://permadi.com/1996/05/ray-casting-tutorial-9/
-            ray_length = geometry.length(ray)
-            ray_relative_angle = self.rotation_delta - ray.get_rd()
-            ray_distance = ray_length * math.cos(ray_relative_angle)
-
-            actual_slice_height = self.wall_height
-            distance_to_slice = ray_distance
-            distance_to_projection_plane = self.camera_plane_distance
-            projected_slice_height = (actual_slice_height / distance_to_slice) * distance_to_projection_plane
-
-            # Create the segment
-            seg_p1 = (segment_count * padding, (self.height / 2) - projected_slice_height / 2)
-            seg_p2 = (segment_count * padding, (self.height / 2) + projected_slice_height / 2)
-            seg_c = self.depth_shader(ray.get_color(), ray_length, aug=self.fog_color)
-
-            # Add segment to frame
-            frame.add_segment(Segment(seg_c, seg_p1, seg_p2))
-            segment_count += 1
+    def generate_frame(self, hits):
+        frame = self.frame
+
+        # Help with the math: https://permadi.com/1996/05/ray-casting-tutorial-9/
+        # Rays that hit nothing are drawn at the view distance
+        depths = frame.get_depths()
+        np.minimum(hits.distances, self.view_radius, out=depths)
+        projected_slice_heights = self.column_scales / np.maximum(depths, 1e-6)
+        np.subtract(self.height / 2, projected_slice_heights / 2, out=frame.get_tops())
+        np.add(self.height / 2, projected_slice_heights / 2, out=frame.get_bottoms())
+
+        frame.get_colors()[:] = self.depth_shader(hits.get_colors(), depths)
         return frame
 
-    # Behold, the epitome of list comprehension
-    def depth_shader(self, col, length, aug):
-        return [
-            max(aug[i], col[i] - ((col[i] - aug[i]) * math.log(length + 1) / math.log(self.lighting_distance + 1)))
-            for i in range(len(col))]
+    def depth_shader(self, colors, depths):
+        """
+        Fades colors into the fog color with distance, using the precomputed shade table
+        :param colors: (n, 3) array of colors
+        :param depths: (n,) array of distances, at most the view radius
+        :return: (n,) array of packed shaded colors
+        """
+        # Interpolate between neighbouring entries, the falloff is too steep up close for a plain lookup
+        x = depths * self.shade_table_resolution
+        q = np.minimum(x.astype(np.intp), len(self.shade_keep) - 2)
+        frac = (x - q)[:, None]
+        keep = self.shade_keep[q][:, None]
+        keep += (self.shade_keep[q + 1][:, None] - keep) * frac
+        fog = self.shade_fog[q]
+        fog += (self.shade_fog[q + 1] - fog) * frac
+        shaded = colors * keep
+        shaded += fog
+        np.maximum(shaded, self.fog_color, out=shaded)
+        return pack_colors(shaded)
 
     # Handles all valid key presses
-    def process_keys(self, movement_collidable_walls):
+    def process_keys(self, world_objects):
         keys = pygame.key.get_pressed()
         # Handle Sprint
         if keys[pygame.K_LSHIFT]:
@@ -526,13 +1342,13 @@ class Camera:
         else:
             self.sprint_mod = 0
         if keys[pygame.K_w]:
-            self.move_forward(movement_collidable_walls)
+            self.move_forward(world_objects)
         if keys[pygame.K_s]:
-            self.move_backward(movement_collidable_walls)
+            self.move_backward(world_objects)
         if keys[pygame.K_a]:
-            self.move_left(movement_collidable_walls)
+            self.move_left(world_objects)
         if keys[pygame.K_d]:
-            self.move_right(movement_collidable_walls)
+            self.move_right(world_objects)
         if keys[pygame.K_q]:
             self.rotate_left()
         if keys[pygame.K_e]:
@@ -547,45 +1363,64 @@ class Camera:
     def get_rotation_delta(self):
         return self.rotation_delta
 
+    def set_rotation_delta(self, rotation_delta):
+        if rotation_delta != self.rotation_delta:
+            self.rotation_delta = rotation_delta
+            self.pose_version += 1
+
     def get_ray_count(self):
         return self.ray_count
 
     def get_camera_rays(self):
         return self.cone_rays
 
-    # Returns the ray at the center of the FoV cone
-    def get_center_ray(self):
-        return self.cone_rays[round(len(self.cone_rays) / 2)]
+    def get_ray_starts(self):
+        return self.ray_starts
+
+    def get_ray_ends(self):
+        return self.ray_ends
+
+    def get_ray_angles(self):
+        return self.ray_angles
+
+    # Index of the column under the reticle, clamped for cameras with a single column
+    def get_center_column(self):
+        return min(round(self.ray_count / 2), self.ray_count - 1)
 
     def get_position(self):
         return self.position
 
     def set_position(self, position):
-        self.position = position
+        if position != self.position:
+            self.position = position
+            self.pose_version += 1
+
+    def get_pose_version(self):
+        return self.pose_version
 
-    def move_left(self, walls):
+    def move_left(self, world_objects):
         dx = (self.movement_units + self.sprint_mod) * math.cos(self.rotation_delta - math.pi / 2)
         dy = (self.movement_units + self.sprint_mod) * math.sin(self.rotation_delta - math.pi / 2)
-        self.position = (self.position[0] + dx, self.position[1] + dy)
-        # self.position = self.check_movement_collisions(p1, p2, walls)
+        self.set_position(self.check_movement_collisions(self.position, (self.position[0] + dx, self.position[1] + dy),
+                                                         world_objects))
 
-    def move_right(self, walls):
+    def move_right(self, world_objects):
         dx = (self.movement_units + self.sprint_mod) * math.cos(self.rotation_delta + math.pi / 2)
         dy = (self.movement_units + self.sprint_mod) * math.sin(self.rotation_delta + math.pi / 2)
-        self.position = (self.position[0] + dx, self.position[1] + dy)
-        # self.position = self.check_movement_collisions(p1, p2, walls)
+        self.set_position(self.check_movement_collisions(self.position, (self.position[0] + dx, self.position[1] + dy),
+                                                         world_objects))
 
-    def move_forward(self, walls):
+    def move_forward(self, world_objects):
         dx = (self.movement_units + self.sprint_mod) * math.cos(self.rotation_delta)
         dy = (self.movement_units + self.sprint_mod) * math.sin(self.rotation_delta)
-        self.position = (self.position[0] + dx, self.position[1] + dy)
-        # self.position = self.check_movement_collisions(p1, p2, walls)
+        self.set_position(self.check_movement_collisions(self.position, (self.position[0] + dx, self.position[1] + dy),
+                                                         world_objects))
 
-    def move_backward(self, walls):
+    def move_backward(self, world_objects):
         dx = (self.movement_units + self.sprint_mod) * math.cos(self.rotation_delta)
         dy = (self.movement_units + self.sprint_mod) * math.sin(self.rotation_delta)
-        self.position = (self.position[0] - dx, self.position[1] - dy)
-        # self.position = self.check_movement_collisions(p1, p2, walls)
+        self.set_position(self.check_movement_collisions(self.position, (self.position[0] - dx, self.position[1] - dy),
+                                                         world_objects))
 
     def rotate_left(self):
         self.rotate(-self.rotation_units)
@@ -599,6 +1434,8 @@ class Camera:
 
     # Rotates the camera a certain number of degrees
     def rotate(self, delta):
+        if delta != 0:
+            self.pose_version += 1
         if delta > 0:
             if self.rotation_delta < (360 * (math.pi / 180)):
                 self.rotation_delta = self.rotation_delta + delta
@@ -610,29 +1447,15 @@ class Camera:
             if self.rotation_delta > (0 * (math.pi / 180)):
                 self.rotation_delta = self.rotation_delta + delta
 
-    def check_movement_collisions(self, cur_pos, new_pos, walls):
+    def check_movement_collisions(self, cur_pos, new_pos, world_objects):
         """
-        Checks if a wall passes through the movement from one pos to another
+        Moves the player's collision circle from one pos towards another, sliding along any wall or
+        circle in the way
         :param cur_pos: current position
         :param new_pos: new position
-        :param walls: set of walls to check
-        :return: returns point along wall if collision, else new_pos
-        """
-        player_line = geometry.Line(cur_pos, new_pos)
-        for k in walls:
-            for wall in walls[k]:
-                if wall is not None:
-                    p2 = geometry.intersect(player_line, wall)
-                    if p2 is not None:
-                        # Awful sliding along a wall, just return new_pos if you want to turn this off
-                        d_cn = geometry.dist(cur_pos, new_pos)
-                        d_cp = geometry.dist(cur_pos, p2)
-                        x_diff = d_cn - d_cp
-                        y_diff = x_diff
-                        if cur_pos[0] < new_pos[0]:
-                            x_diff *= -1
-                        if cur_pos[1] < new_pos[1]:
-                            y_diff *= -1
-                        np = cur_pos[0] + x_diff, cur_pos[1] + y_diff
-                        return np
-        return new_pos
+        :param world_objects: WorldState to collide with
+        :return: position the player ends up at
+        """
+        if world_objects is None or self.player_radius <= 0:
+            return new_pos
+        return world_objects.slide_circle(cur_pos, new_pos, self.player_radius)
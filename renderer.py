@@ -0,0 +1,122 @@
+import numpy as np
+import pygame
+
+import pycaster
+
+
+class LineRenderer:
+    """
+    Draws a frame one column at a time, with a pygame.draw.line call per column
+    """
+
+    def __init__(self, width, height, sky_color, ground_color):
+        """
+        :param width: width of the surface being drawn to
+        :param height: height of the surface being drawn to
+        :param sky_color: color above the horizon
+        :param ground_color: color below the horizon
+        """
+        self.width = width
+        self.height = height
+        self.sky_color = sky_color
+        self.ground_color = ground_color
+
+    def draw(self, surface, frame):
+        surface.fill((0, 0, 0))
+        pygame.draw.rect(surface, self.sky_color, ((0, 0), (self.width, self.height / 2)))
+        pygame.draw.rect(surface, self.ground_color, ((0, self.height / 2), (self.width, self.height)))
+        segment_width = frame.get_segment_width()
+        xs = frame.get_xs().tolist()
+        tops = frame.get_tops().tolist()
+        bottoms = frame.get_bottoms().tolist()
+        colors = frame.get_colors().tolist()
+        for i in range(frame.get_column_count()):
+            pygame.draw.line(surface, pycaster.unpack_color(colors[i]), (xs[i], tops[i]), (xs[i], bottoms[i]), segment_width)
+
+
+class FramebufferRenderer:
+    """
+    Fills a reusable pixel buffer from a frame's column arrays in bulk, then blits it to the
+    surface in a single call
+    """
+
+    def __init__(self, width, height, sky_color, ground_color):
+        """
+        :param width: width of the surface being drawn to
+        :param height: height of the surface being drawn to
+        :param sky_color: color above the horizon
+        :param ground_color: color below the horizon
+        """
+        self.width = width
+        self.height = height
+
+        # Packed 0xRRGGBB pixels, indexed [x, y] to match pygame.surfarray
+        self.pixels = np.empty((width, height), dtype=np.uint32)
+        # Scratch buffers for the per-pixel column test
+        self.mask = np.empty((width, height), dtype=bool)
+        self.mask_below = np.empty((width, height), dtype=bool)
+        # Used when the surface isn't 32-bit 0xRRGGBB and needs an RGB array instead
+        self.rgb = None
+
+        self.ys = np.arange(height)
+        # The sky/ground gradient every column starts from
+        self.background = np.where(self.ys < height / 2, pycaster.pack_color(sky_color),
+                                   pycaster.pack_color(ground_color)).astype(np.uint32)
+
+        # Screen x -> frame column, rebuilt when the frame's column count changes
+        self.column_map = None
+
+    def get_column_map(self, frame):
+        """
+        Maps each screen x to the column drawn closest to it
+        :param frame: the frame being drawn
+        :return: (width,) array of column indices
+        """
+        n = frame.get_column_count()
+        if self.column_map is None or self.column_map_count != n:
+            padding = self.width / n
+            self.column_map = np.clip(np.rint(np.arange(self.width) / padding), 0, n - 1).astype(np.intp)
+            self.column_map_count = n
+        return self.column_map
+
+    def fill(self, frame):
+        """
+        Renders a frame into the pixel buffer
+        :param frame: the frame being drawn
+        :return: (width, height) array of packed pixels
+        """
+        columns = self.get_column_map(frame)
+        tops = frame.get_tops()[columns][:, None]
+        bottoms = frame.get_bottoms()[columns][:, None]
+        colors = frame.get_colors()[columns][:, None]
+
+        np.greater_equal(self.ys, tops, out=self.mask)
+        np.less_equal(self.ys, bottoms, out=self.mask_below)
+        self.mask &= self.mask_below
+
+        self.pixels[:] = self.background
+        np.copyto(self.pixels, colors, where=self.mask)
+        return self.pixels
+
+    def draw(self, surface, frame):
+        self.fill(frame)
+        if surface.get_bitsize() == 32 and surface.get_masks()[:3] == (0xff0000, 0xff00, 0xff):
+            pygame.surfarray.blit_array(surface, self.pixels)
+            return
+        if self.rgb is None:
+            self.rgb = np.empty((self.width, self.height, 3), dtype=np.uint8)
+        self.rgb[:, :, 0] = self.pixels >> 16
+        self.rgb[:, :, 1] = self.pixels >> 8
+        self.rgb[:, :, 2] = self.pixels
+        pygame.surfarray.blit_array(surface, self.rgb)
+
+
+def get_renderer(name, width, height, sky_color, ground_color):
+    """
+    Creates a renderer by its name in settings.ini
+    :param name: line or framebuffer
+    :return: renderer with a draw(surface, frame) method
+    """
+    if name == "framebuffer":
+        return FramebufferRenderer(width, height, sky_color, ground_color)
+    return LineRenderer(width, height, sky_color, ground_color)
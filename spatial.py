@@ -0,0 +1,352 @@
+import math
+
+import geometry
+
+
+class SpatialHash:
+    """
+    Uniform grid that maps each cell to the world objects overlapping it. Used for broad-phase
+    collision detection so range queries only visit the cells around the query box instead
+    of every object in the world. Objects are inserted as line segments or circles.
+    """
+
+    def __init__(self, cell_size):
+        """
+        :param cell_size: width and height of each grid cell in world units
+        """
+        self.cell_size = cell_size
+        # (cell x, cell y) -> {object: None}, dicts keep insertion order so queries are deterministic
+        self.cells = {}
+        # object -> cells it was rasterized into, so removal doesn't have to re-rasterize
+        self.object_cells = {}
+        # object -> (p1, p2) of the segment it was inserted with, used for the exact range test
+        self.segments = {}
+        # object -> (center, r) of the circle it was inserted with
+        self.circles = {}
+
+    def get_cell(self, p):
+        return math.floor(p[0] / self.cell_size), math.floor(p[1] / self.cell_size)
+
+    def segment_cells(self, p1, p2):
+        """
+        Rasterizes a segment into every grid cell it passes through (Amanatides & Woo traversal)
+        :param p1: start of the segment
+        :param p2: end of the segment
+        :return: list of cells
+        """
+        x0, y0 = p1[0] / self.cell_size, p1[1] / self.cell_size
+        x1, y1 = p2[0] / self.cell_size, p2[1] / self.cell_size
+        cx, cy = math.floor(x0), math.floor(y0)
+        ex, ey = math.floor(x1), math.floor(y1)
+        dx, dy = x1 - x0, y1 - y0
+
+        step_x = 1 if dx > 0 else -1
+        step_y = 1 if dy > 0 else -1
+        # Distance along the segment (0 - 1) to the next vertical/horizontal cell boundary
+        t_max_x = ((cx + (dx > 0)) - x0) / dx if dx != 0 else math.inf
+        t_max_y = ((cy + (dy > 0)) - y0) / dy if dy != 0 else math.inf
+        t_delta_x = abs(1 / dx) if dx != 0 else math.inf
+        t_delta_y = abs(1 / dy) if dy != 0 else math.inf
+
+        cells = [(cx, cy)]
+        # The number of steps is fixed up front so float error can never walk past the end cell
+        for _ in range(abs(ex - cx) + abs(ey - cy)):
+            if t_max_x < t_max_y:
+                cx += step_x
+                t_max_x += t_delta_x
+            else:
+                cy += step_y
+                t_max_y += t_delta_y
+            cells.append((cx, cy))
+        return cells
+
+    def insert_segment(self, obj, p1, p2):
+        """
+        Adds an object to every cell its segment overlaps
+        :param obj: object being indexed
+        :param p1: start of the segment
+        :param p2: end of the segment
+        """
+        if obj in self.object_cells:
+            self.remove(obj)
+        cells = self.segment_cells(p1, p2)
+        for cell in cells:
+            if cell in self.cells:
+                self.cells[cell][obj] = None
+            else:
+                self.cells[cell] = {obj: None}
+        self.object_cells[obj] = cells
+        self.segments[obj] = (p1, p2)
+
+    def insert_circle(self, obj, center, r):
+        """
+        Adds an object to every cell its circle's bounding box overlaps
+        :param obj: object being indexed
+        :param center: center of the circle
+        :param r: radius of the circle
+        """
+        if obj in self.object_cells:
+            self.remove(obj)
+        lo = self.get_cell((center[0] - r, center[1] - r))
+        hi = self.get_cell((center[0] + r, center[1] + r))
+        cells = [(cx, cy) for cx in range(lo[0], hi[0] + 1) for cy in range(lo[1], hi[1] + 1)]
+        for cell in cells:
+            if cell in self.cells:
+                self.cells[cell][obj] = None
+            else:
+                self.cells[cell] = {obj: None}
+        self.object_cells[obj] = cells
+        self.circles[obj] = (center, r)
+
+    def remove(self, obj):
+        """
+        Removes an object from every cell it was inserted into
+        :param obj: object being removed
+        """
+        for cell in self.object_cells.pop(obj, ()):
+            bucket = self.cells[cell]
+            bucket.pop(obj, None)
+            if not bucket:
+                del self.cells[cell]
+        self.segments.pop(obj, None)
+        self.circles.pop(obj, None)
+
+    def clear(self):
+        self.cells.clear()
+        self.object_cells.clear()
+        self.segments.clear()
+        self.circles.clear()
+
+    def overlaps_box(self, obj, lo, hi):
+        if obj in self.segments:
+            return geometry.segment_box_intersect(*self.segments[obj], lo, hi)
+        return geometry.circle_box_intersect(*self.circles[obj], lo, hi)
+
+    def query_box(self, lo, hi):
+        """
+        Finds every object whose segment or circle overlaps a box
+        :param lo: (min x, min y) corner of the box
+        :param hi: (max x, max y) corner of the box
+        :return: list of objects, each listed once
+        """
+        c_lo = self.get_cell(lo)
+        c_hi = self.get_cell(hi)
+        found = {}
+        # Walk whichever is smaller, the cells under the box or the occupied cells
+        if (c_hi[0] - c_lo[0] + 1) * (c_hi[1] - c_lo[1] + 1) <= len(self.cells):
+            for cx in range(c_lo[0], c_hi[0] + 1):
+                for cy in range(c_lo[1], c_hi[1] + 1):
+                    bucket = self.cells.get((cx, cy))
+                    if bucket:
+                        found.update(bucket)
+        else:
+            for cell in self.cells:
+                if c_lo[0] <= cell[0] <= c_hi[0] and c_lo[1] <= cell[1] <= c_hi[1]:
+                    found.update(self.cells[cell])
+        return [obj for obj in found if self.overlaps_box(obj, lo, hi)]
+
+    def __len__(self):
+        return len(self.object_cells)
+
+
+class BVH:
+    """
+    Bounding volume hierarchy over line segments. Ray queries walk the tree front-to-back and stop
+    as soon as no remaining box could hold a hit closer than the best one found, so the cost per
+    ray grows with the depth of the tree rather than the number of segments.
+
+    Segments can be added and removed without rebuilding: removed segments are tombstoned and
+    skipped, and added segments wait in a pending list that is tested linearly, until
+    needs_rebuild says a rebuild would pay off.
+    """
+
+    def __init__(self, leaf_size=4):
+        """
+        :param leaf_size: maximum number of segments stored in a leaf node
+        """
+        self.leaf_size = leaf_size
+        # Segments are stored flat as (x1, y1, x2, y2) in tree order, alongside the objects they belong to
+        self.objects = []
+        self.segments = []
+        # Node arrays. Leaves have a count > 0 and index into segments with start,
+        # inner nodes have a count of 0 and point to their children with left/right
+        self.boxes = []
+        self.left = []
+        self.right = []
+        self.start = []
+        self.count = []
+        # Objects removed since the last build, and object -> segment added since the last build
+        self.removed = set()
+        self.pending = {}
+
+    def build(self, items):
+        """
+        Rebuilds the tree from scratch
+        :param items: iterable of (object, p1, p2) segments
+        """
+        items = [(obj, (p1[0], p1[1], p2[0], p2[1])) for obj, p1, p2 in items]
+        self.objects = []
+        self.segments = []
+        self.boxes = []
+        self.left = []
+        self.right = []
+        self.start = []
+        self.count = []
+        self.removed = set()
+        self.pending = {}
+        if items:
+            self.build_node(items)
+
+    def insert(self, obj, p1, p2):
+        """
+        Adds a segment to the pending list
+        """
+        self.pending[obj] = (p1[0], p1[1], p2[0], p2[1])
+
+    def remove(self, obj):
+        """
+        Removes a segment, tombstoning it if it is in the tree
+        """
+        if self.pending.pop(obj, None) is None:
+            self.removed.add(obj)
+
+    def needs_rebuild(self):
+        """
+        :return: True once enough segments are pending or tombstoned that queries are slowed down more
+        than a rebuild costs
+        """
+        return len(self.pending) > 64 or len(self.removed) > len(self.objects) // 2
+
+    def build_node(self, items):
+        node = len(self.boxes)
+        self.boxes.append((
+            min(min(s[0], s[2]) for _, s in items),
+            min(min(s[1], s[3]) for _, s in items),
+            max(max(s[0], s[2]) for _, s in items),
+            max(max(s[1], s[3]) for _, s in items)))
+        self.left.append(-1)
+        self.right.append(-1)
+        self.start.append(len(self.segments))
+        self.count.append(0)
+
+        if len(items) <= self.leaf_size:
+            for obj, seg in items:
+                self.objects.append(obj)
+                self.segments.append(seg)
+            self.count[node] = len(items)
+            return node
+
+        # Split at the median centroid along the longest axis of the node's box
+        box = self.boxes[node]
+        axis = 0 if box[2] - box[0] >= box[3] - box[1] else 1
+        items.sort(key=lambda item: item[1][axis] + item[1][axis + 2])
+        mid = len(items) // 2
+        self.left[node] = self.build_node(items[:mid])
+        self.right[node] = self.build_node(items[mid:])
+        return node
+
+    def box_entry(self, node, ox, oy, dx, dy, t_max):
+        """
+        Slab test between a ray and a node's box
+        :return: ray parameter where the ray enters the box, or None if it misses before t_max
+        """
+        lo_x, lo_y, hi_x, hi_y = self.boxes[node]
+        t0, t1 = 0.0, t_max
+        if dx == 0:
+            if ox < lo_x or ox > hi_x:
+                return None
+        else:
+            ta = (lo_x - ox) / dx
+            tb = (hi_x - ox) / dx
+            if ta > tb:
+                ta, tb = tb, ta
+            t0 = max(t0, ta)
+            t1 = min(t1, tb)
+        if dy == 0:
+            if oy < lo_y or oy > hi_y:
+                return None
+        else:
+            ta = (lo_y - oy) / dy
+            tb = (hi_y - oy) / dy
+            if ta > tb:
+                ta, tb = tb, ta
+            t0 = max(t0, ta)
+            t1 = min(t1, tb)
+        if t0 > t1:
+            return None
+        return t0
+
+    def closest_hit(self, p1, p2):
+        """
+        Finds the closest segment hit by a ray
+        :param p1: start of the ray
+        :param p2: end of the ray
+        :return: (t, u, object) where t is the position along the ray (0 - 1) and u is the position
+        along the hit segment (0 - 1), or None if nothing was hit
+        """
+        ox, oy = p1
+        dx, dy = p2[0] - ox, p2[1] - oy
+        best = None
+        best_t = 1.0
+        # Pending segments aren't in the tree yet, test them first so their hits can prune it
+        for obj, (x1, y1, x2, y2) in self.pending.items():
+            sx, sy = x2 - x1, y2 - y1
+            den = dx * sy - dy * sx
+            if den == 0:
+                continue
+            wx, wy = x1 - ox, y1 - oy
+            t = (wx * sy - wy * sx) / den
+            u = (wx * dy - wy * dx) / den
+            if 0 <= t <= best_t and 0 <= u <= 1:
+                best_t = t
+                best = (t, u, obj)
+        if not self.boxes:
+            return best
+        entry = self.box_entry(0, ox, oy, dx, dy, best_t)
+        if entry is None:
+            return best
+        removed = self.removed
+        stack = [(entry, 0)]
+        while stack:
+            entry, node = stack.pop()
+            # A closer hit was found after this node was pushed
+            if entry > best_t:
+                continue
+            count = self.count[node]
+            if count:
+                start = self.start[node]
+                for i in range(start, start + count):
+                    x1, y1, x2, y2 = self.segments[i]
+                    sx, sy = x2 - x1, y2 - y1
+                    den = dx * sy - dy * sx
+                    if den == 0:
+                        continue
+                    wx, wy = x1 - ox, y1 - oy
+                    t = (wx * sy - wy * sx) / den
+                    u = (wx * dy - wy * dx) / den
+                    if 0 <= t <= best_t and 0 <= u <= 1:
+                        if removed and self.objects[i] in removed:
+                            continue
+                        best_t = t
+                        best = (t, u, self.objects[i])
+                continue
+            # Push the far child first so the near child is visited first
+            left = self.left[node]
+            right = self.right[node]
+            t_left = self.box_entry(left, ox, oy, dx, dy, best_t)
+            t_right = self.box_entry(right, ox, oy, dx, dy, best_t)
+            if t_left is not None and t_right is not None:
+                if t_left <= t_right:
+                    stack.append((t_right, right))
+                    stack.append((t_left, left))
+                else:
+                    stack.append((t_left, left))
+                    stack.append((t_right, right))
+            elif t_left is not None:
+                stack.append((t_left, left))
+            elif t_right is not None:
+                stack.append((t_right, right))
+        return best
+
+    def __len__(self):
+        return len(self.objects) - len(self.removed) + len(self.pending)
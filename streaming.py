@@ -0,0 +1,274 @@
+"""
+Chunked world streaming for the pycaster.
+
+A map is split into fixed-size square chunks on disk, one binary map per chunk plus a manifest.
+While the camera moves, a ChunkStreamer keeps the chunks within the view distance (plus a prefetch
+margin) resident in a WorldState. Chunk files are read on a background thread. The loaded walls
+are merged into the world a bounded number at a time per frame, and chunks that are no longer
+needed are evicted least recently used first once a memory budget is exceeded.
+
+Usage:
+    python streaming.py <map file> <chunk directory> [--chunk-size 500]
+"""
+import argparse
+import collections
+import json
+import math
+import os
+import queue
+import threading
+
+import numpy as np
+
+import geometry
+import mapio
+
+MANIFEST = "chunks.json"
+
+# Rough resident cost of one wall or circle in a WorldState, including its table row, view and
+# index entries. Used to turn the memory budget into object counts
+WALL_BYTES = 1600
+CIRCLE_BYTES = 400
+
+
+def get_chunk(x, y, chunk_size):
+    return math.floor(x / chunk_size), math.floor(y / chunk_size)
+
+
+def build_chunks(map_file, directory, chunk_size=500):
+    """
+    Splits a binary map into chunk files. Each wall goes in the chunk holding its midpoint and each
+    circle in the chunk holding its center
+    :param map_file: mapio.MapFile
+    :param directory: where the chunk files and manifest are written
+    :param chunk_size: width and height of a chunk in world units
+    """
+    os.makedirs(directory, exist_ok=True)
+    walls = map_file.get_walls()
+    circles = map_file.get_circles()
+    wall_chunks = np.floor((walls["p1"] + walls["p2"]) / 2 / chunk_size).astype(np.int64)
+    circle_chunks = np.floor(circles["center"] / chunk_size).astype(np.int64)
+
+    # Objects are only loaded with their home chunk, so the area loaded around the camera is grown by
+    # the furthest any object reaches out of it
+    margin = 0.0
+    if len(walls):
+        margin = float(np.max(np.hypot(*(walls["p2"] - walls["p1"]).T)) / 2)
+    if len(circles):
+        margin = max(margin, float(circles["r"].max()))
+
+    chunks = {}
+    keys = set(map(tuple, wall_chunks.tolist())) | set(map(tuple, circle_chunks.tolist()))
+    for cx, cy in sorted(keys):
+        name = f"chunk_{cx}_{cy}{mapio.EXTENSION}"
+        chunk_walls = walls[np.all(wall_chunks == (cx, cy), axis=1)] if len(walls) else walls
+        chunk_circles = circles[np.all(circle_chunks == (cx, cy), axis=1)] if len(circles) else circles
+        mapio.save_map(os.path.join(directory, name), map_file.get_group_names(), chunk_walls, chunk_circles)
+        chunks[f"{cx},{cy}"] = {"file": name, "walls": len(chunk_walls), "circles": len(chunk_circles)}
+
+    with open(os.path.join(directory, MANIFEST), 'w') as file:
+        json.dump({"chunk_size": chunk_size, "margin": margin, "chunks": chunks}, file, indent=1)
+
+
+class ChunkStreamer:
+    """
+    Keeps the chunks around the camera resident in a WorldState
+    """
+
+    def __init__(self, world_objects, directory, prefetch=100, memory_budget=256 * 2 ** 20, merge_budget=250):
+        """
+        :param world_objects: WorldState the chunks are streamed into
+        :param directory: chunk directory written by build_chunks
+        :param prefetch: distance beyond the view distance that chunks are loaded ahead of time
+        :param memory_budget: approximate bytes of resident chunks before unneeded ones are evicted
+        :param merge_budget: maximum number of objects merged into or evicted from the world per update. Each
+        object costs roughly 10-25 us, so the default keeps an update to a few ms
+        """
+        self.world_objects = world_objects
+        self.directory = directory
+        self.prefetch = prefetch
+        self.memory_budget = memory_budget
+        self.merge_budget = merge_budget
+
+        with open(os.path.join(directory, MANIFEST), 'r') as file:
+            manifest = json.load(file)
+        self.chunk_size = manifest["chunk_size"]
+        self.margin = manifest["margin"]
+        self.chunks = {tuple(int(v) for v in key.split(",")): info for key, info in manifest["chunks"].items()}
+
+        # Chunks that have been loaded, including ones still being merged, chunk -> (wall group keys, circle group keys)
+        self.resident = {}
+        # Chunks being loaded or merged
+        self.requested = set()
+        # Loaded pieces waiting to be merged, as (chunk, kind, world key, records, start)
+        self.merging = collections.deque()
+        # Groups of evicted chunks waiting to be removed, as (chunk, kind, world key)
+        self.evicting = collections.deque()
+        # Chunk -> update count it was last wanted on
+        self.last_wanted = {}
+        self.updates = 0
+        self.resident_bytes = 0
+
+        self.requests = queue.Queue()
+        self.loaded = queue.Queue()
+        self.thread = threading.Thread(target=self.load_loop, daemon=True)
+        self.thread.start()
+
+    def load_loop(self):
+        while True:
+            chunk = self.requests.get()
+            if chunk is None:
+                return
+            map_file = mapio.load_map(os.path.join(self.directory, self.chunks[chunk]["file"]))
+            # Copy out of the memmap so the render thread never touches the disk
+            walls = {key: np.array(records) for key, records in map_file.get_group_walls().items()}
+            circles = {key: np.array(records) for key, records in map_file.get_group_circles().items()}
+            self.loaded.put((chunk, walls, circles))
+
+    def get_chunk_key(self, key, chunk):
+        """
+        :return: world group key of a map group's objects from one chunk
+        """
+        return f"{key}@{chunk[0]},{chunk[1]}"
+
+    def get_chunk_bytes(self, chunk):
+        info = self.chunks[chunk]
+        return info["walls"] * WALL_BYTES + info["circles"] * CIRCLE_BYTES
+
+    def get_wanted_chunks(self, position, view_radius):
+        """
+        :return: set of chunks that could hold objects within view_radius plus the prefetch distance
+        """
+        r = view_radius + self.prefetch + self.margin
+        lo = get_chunk(position[0] - r, position[1] - r, self.chunk_size)
+        hi = get_chunk(position[0] + r, position[1] + r, self.chunk_size)
+        if (hi[0] - lo[0] + 1) * (hi[1] - lo[1] + 1) > len(self.chunks):
+            return {c for c in self.chunks if lo[0] <= c[0] <= hi[0] and lo[1] <= c[1] <= hi[1]}
+        return {(cx, cy) for cx in range(lo[0], hi[0] + 1) for cy in range(lo[1], hi[1] + 1) if (cx, cy) in self.chunks}
+
+    def update(self, position, view_radius):
+        """
+        Requests the chunks around a position, merges loaded objects and evicts chunks over the
+        memory budget. Does at most merge_budget objects of work
+        :param position: camera position
+        :param view_radius: camera view distance
+        """
+        self.updates += 1
+        wanted = self.get_wanted_chunks(position, view_radius)
+        # A chunk is only requested again once all of its old objects are out of the world
+        evicting = {piece[0] for piece in self.evicting}
+        for chunk in wanted:
+            self.last_wanted[chunk] = self.updates
+            if chunk not in self.resident and chunk not in self.requested and chunk not in evicting:
+                self.requested.add(chunk)
+                self.requests.put(chunk)
+
+        while True:
+            try:
+                chunk, walls, circles = self.loaded.get_nowait()
+            except queue.Empty:
+                break
+            self.resident[chunk] = ([], [])
+            self.resident_bytes += self.get_chunk_bytes(chunk)
+            for key, records in walls.items():
+                self.merging.append((chunk, "wall", self.get_chunk_key(key, chunk), records, 0))
+            for key, records in circles.items():
+                self.merging.append((chunk, "circle", self.get_chunk_key(key, chunk), records, 0))
+
+        evicted = self.evict(wanted, self.merge_budget)
+        self.merge(self.merge_budget - evicted)
+
+    def merge(self, budget):
+        """
+        Adds loaded objects to the world
+        :param budget: maximum number of objects to add
+        :return: number of objects added
+        """
+        done = 0
+        while self.merging and done < budget:
+            chunk, kind, key, records, start = self.merging.popleft()
+            stop = min(len(records), start + budget - done)
+            piece = records[start:stop]
+            if kind == "wall":
+                self.world_objects.add_wall_arrays(key, piece["p1"], piece["p2"], piece["color"])
+                self.resident[chunk][0].append(key)
+            else:
+                self.world_objects.add_circles(key, [
+                    geometry.Circle(tuple(center), r, tuple(color)) for center, r, color in
+                    zip(piece["center"].tolist(), piece["r"].tolist(), piece["color"].tolist())])
+                self.resident[chunk][1].append(key)
+            done += stop - start
+            if stop < len(records):
+                self.merging.appendleft((chunk, kind, key, records, stop))
+            else:
+                self.finish_chunk(chunk)
+        return done
+
+    def finish_chunk(self, chunk):
+        # The chunk stops being requested once its last piece is merged
+        if not any(piece[0] == chunk for piece in self.merging):
+            self.requested.discard(chunk)
+
+    def evict(self, wanted, budget):
+        """
+        Evicts the least recently wanted chunks that aren't wanted now until the resident chunks fit
+        in the memory budget. Their objects are removed from the world a bounded number at a time,
+        so a large chunk is spread over several updates
+        :param wanted: chunks that must stay resident
+        :param budget: maximum number of objects to remove
+        :return: number of objects removed
+        """
+        if self.resident_bytes > self.memory_budget:
+            candidates = sorted((c for c in self.resident if c not in wanted), key=lambda c: self.last_wanted.get(c, 0))
+            for chunk in candidates:
+                if self.resident_bytes <= self.memory_budget:
+                    break
+                wall_keys, circle_keys = self.resident.pop(chunk)
+                self.merging = collections.deque(piece for piece in self.merging if piece[0] != chunk)
+                self.evicting += [(chunk, "wall", key) for key in dict.fromkeys(wall_keys)]
+                self.evicting += [(chunk, "circle", key) for key in dict.fromkeys(circle_keys)]
+                self.requested.discard(chunk)
+                self.resident_bytes -= self.get_chunk_bytes(chunk)
+
+        done = 0
+        walls = self.world_objects.get_all_walls()
+        circles = self.world_objects.get_circles()
+        while self.evicting and done < budget:
+            chunk, kind, key = self.evicting[0]
+            if kind == "wall":
+                done += self.world_objects.pop_walls(key, budget - done) if key in walls else 0
+                finished = key not in walls
+            else:
+                done += self.world_objects.pop_circles(key, budget - done) if key in circles else 0
+                finished = key not in circles
+            if finished:
+                self.evicting.popleft()
+        return done
+
+    def get_resident_chunks(self):
+        return list(self.resident)
+
+    def get_resident_bytes(self):
+        return self.resident_bytes
+
+    def is_idle(self):
+        """
+        :return: True when nothing is being loaded, merged or evicted
+        """
+        return not self.requested and not self.merging and not self.evicting
+
+    def close(self):
+        self.requests.put(None)
+        self.thread.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Split a map into chunks for streaming")
+    parser.add_argument("map", help="map in the text or binary format")
+    parser.add_argument("directory", help="where the chunks are written")
+    parser.add_argument("--chunk-size", type=float, default=500)
+    args = parser.parse_args()
+    if mapio.is_binary_map(args.map):
+        build_chunks(mapio.load_map(args.map), args.directory, args.chunk_size)
+    else:
+        build_chunks(mapio.MapFile(*mapio.read_text_arrays(args.map)), args.directory, args.chunk_size)
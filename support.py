@@ -1,22 +1,230 @@
+import csv
+import functools
+import json
+import threading
 import time
 
+import numpy as np
 
-class Timer:
-    def __init__(self):
-        self.start_time = time.time()
-        self.current_time = None
-        self.last_time = None
-        self.time_record = []
-
-    # Returns time since last func call in ms
-    def tick(self):
-        if self.last_time is None:
-            self.last_time = time.time()
-        self.current_time = time.time()
-        r_time = self.current_time - self.last_time
-        self.last_time = time.time()
-        self.time_record.append(r_time)
-        return round(r_time * 1000, 4)
-
-    def get_total_time(self):
-        return round((time.time() - self.start_time) * 1000, 3)
+
+class Nesting(threading.local):
+    """
+    Nesting depth of the open spans, kept separately for every thread
+    """
+    depth = 0
+
+
+class Span:
+    """
+    Context manager that times one span for a Profiler. Spans opened inside
+    another span are recorded as its children.
+    """
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0
+
+    def __enter__(self):
+        self.profiler.nesting.depth += 1
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.perf_counter_ns()
+        nesting = self.profiler.nesting
+        nesting.depth -= 1
+        self.profiler.record(self.name, self.start, end, nesting.depth)
+        return False
+
+
+class Profiler:
+    """
+    Low-overhead hierarchical span profiler built on time.perf_counter_ns.
+    Spans are stored in a fixed-size ring buffer, so the oldest spans are
+    overwritten instead of growing without bound, and can be exported as
+    Chrome trace-event JSON.
+    """
+
+    def __init__(self, capacity=65536, stats=None):
+        """
+        :param capacity: number of spans kept in the ring buffer
+        :param stats: optional RollingStats that every span's duration in ms is added to
+        """
+        self.capacity = capacity
+        self.stats = stats
+        self.names = [None] * capacity
+        self.starts = [0] * capacity
+        self.ends = [0] * capacity
+        self.depths = [0] * capacity
+        self.threads = [0] * capacity
+        # Total spans ever recorded, the next span is written at count % capacity
+        self.count = 0
+        # Current nesting depth of each thread's spans
+        self.nesting = Nesting()
+        # Spans can end on several threads at once, the ring slots and counters are claimed under this
+        self.lock = threading.Lock()
+        # Duration in ns of the most recent span with each name
+        self.last = {}
+        # Trace timestamps are relative to when the profiler was created
+        self.origin = time.perf_counter_ns()
+
+    def span(self, name):
+        """
+        Times a block of code
+            with profiler.span("update"):
+                ...
+        :param name: name of the span
+        :return: Span context manager
+        """
+        return Span(self, name)
+
+    def profile(self, name):
+        """
+        Decorator that times every call of a function as a span
+        :param name: name of the span
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with Span(self, name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def record(self, name, start, end, depth):
+        thread = threading.get_ident()
+        with self.lock:
+            i = self.count % self.capacity
+            self.names[i] = name
+            self.starts[i] = start
+            self.ends[i] = end
+            self.depths[i] = depth
+            self.threads[i] = thread
+            self.count += 1
+            self.last[name] = end - start
+        if self.stats is not None:
+            self.stats.add(name, (end - start) / 1e6)
+
+    def get_last_ms(self, name):
+        """
+        :param name: name of the span
+        :return: duration of the most recent span with that name in ms
+        """
+        return round(self.last.get(name, 0) / 1e6, 4)
+
+    def get_spans(self):
+        """
+        :return: list of (name, start ns, end ns, depth, thread id) for every span still in
+        the buffer, oldest first
+        """
+        with self.lock:
+            first = max(0, self.count - self.capacity)
+            spans = []
+            for n in range(first, self.count):
+                i = n % self.capacity
+                spans.append((self.names[i], self.starts[i], self.ends[i], self.depths[i], self.threads[i]))
+        return spans
+
+    def clear(self):
+        with self.lock:
+            self.count = 0
+            self.last.clear()
+
+    def export_chrome_trace(self, filename):
+        """
+        Writes every span in the buffer as Chrome trace-event JSON, which can be opened
+        in chrome://tracing or Perfetto
+        :param filename: output file
+        """
+        events = []
+        for name, start, end, depth, thread in self.get_spans():
+            events.append({
+                "name": name,
+                "ph": "X",
+                "ts": (start - self.origin) / 1000,
+                "dur": (end - start) / 1000,
+                "pid": 1,
+                "tid": thread,
+                "args": {"depth": depth}
+            })
+        with open(filename, 'w') as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+
+class RollingStats:
+    """
+    Keeps a rolling window of the last N samples of each named value, such as
+    frame and stage times, and summarizes them with percentiles so hitches
+    show up instead of being averaged away.
+    """
+
+    def __init__(self, window=600):
+        """
+        :param window: number of samples kept per name
+        """
+        self.window = window
+        # name -> ring buffer of samples, and the total number of samples ever added
+        self.samples = {}
+        self.counts = {}
+        # Samples can be added from several threads, e.g. by spans ending on worker threads
+        self.lock = threading.Lock()
+
+    def add(self, name, value):
+        with self.lock:
+            if name not in self.samples:
+                self.samples[name] = np.zeros(self.window)
+                self.counts[name] = 0
+            self.samples[name][self.counts[name] % self.window] = value
+            self.counts[name] += 1
+
+    def get_names(self):
+        with self.lock:
+            return list(self.samples)
+
+    def get_samples(self, name):
+        """
+        :param name: name of the value
+        :return: samples currently in the window, oldest first
+        """
+        with self.lock:
+            if name not in self.samples:
+                return np.zeros(0)
+            count = self.counts[name]
+            if count <= self.window:
+                return self.samples[name][:count].copy()
+            return np.roll(self.samples[name], -(count % self.window))
+
+    def summarize(self, name):
+        """
+        :param name: name of the value
+        :return: dict of p50, p95, p99, max and the number of samples in the window
+        """
+        samples = self.get_samples(name)
+        if len(samples) == 0:
+            return {"p50": 0, "p95": 0, "p99": 0, "max": 0, "count": 0}
+        p50, p95, p99 = np.percentile(samples, (50, 95, 99))
+        return {
+            "p50": round(float(p50), 3),
+            "p95": round(float(p95), 3),
+            "p99": round(float(p99), 3),
+            "max": round(float(samples.max()), 3),
+            "count": len(samples)
+        }
+
+    def export_csv(self, filename):
+        """
+        Writes the summary of every value, followed by the raw samples in the window
+        :param filename: output file
+        """
+        with open(filename, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(["name", "p50", "p95", "p99", "max", "count"])
+            for name in self.get_names():
+                summary = self.summarize(name)
+                writer.writerow([name, summary["p50"], summary["p95"], summary["p99"], summary["max"], summary["count"]])
+            writer.writerow([])
+            writer.writerow(["name", "samples"])
+            for name in self.get_names():
+                writer.writerow([name] + [round(float(v), 4) for v in self.get_samples(name)])